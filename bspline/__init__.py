@@ -4,11 +4,13 @@
 
 Submodules:
     bspline.bspline
-        OO interface (class Bspline)
+        OO interface (classes Bspline, Spline and TensorBspline)
     bspline.splinelab
         MATLAB-style interface and helper functions.
+    bspline.profiling
+        Opt-in call counters and timers (not imported by default).
 
-By default, the Bspline class from bspline.bspline is imported into this namespace when this module is loaded.
+By default, the Bspline, Spline and TensorBspline classes from bspline.bspline are imported into this namespace when this module is loaded.
 """
 
 from __future__ import absolute_import
@@ -17,5 +19,5 @@ from __future__ import absolute_import
 __version__ = '0.1.1'
 
 # add any imports here, if you wish to bring things into the library's top-level namespace when the library is imported.
-from .bspline import Bspline
+from .bspline import Bspline, Spline, TensorBspline
 
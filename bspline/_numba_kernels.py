@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""Compiled (Numba) kernels for the local-support evaluation engine (for internal use).
+
+Importing this module raises ImportError if Numba is not installed.
+See `bspline.bspline.set_backend`.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+import numba
+
+
+@numba.njit(nogil=True, cache=True)
+def _first_span(tp, t0):
+    """Return the span of t0, the first nonzero-length span: (first index with tp[index] > t0) - 1."""
+    lo = 0
+    hi = tp.shape[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if tp[mid] <= t0:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo - 1
+
+
+@numba.njit(nogil=True, cache=True)
+def _find_span(tp, xi, span, sorted_sites):
+    """Return the span of the site xi, inside [t0, tend).
+
+    If sorted_sites and span >= 0, advance from `span`, the span of the previous site
+    (amortized O(1)); otherwise binary search, so that the first site of a sorted batch
+    does not walk through all knots before it.
+    """
+    if sorted_sites  and  span >= 0:
+        # tp[-1] = tend > xi ends the loop
+        while tp[span+1] <= xi:
+            span += 1
+        return span
+    lo = 0
+    hi = tp.shape[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if tp[mid] <= xi:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo - 1
+
+
+@numba.njit(nogil=True, cache=True)
+def _values(tp, span, xi, p, left, right, N, levels, keep_levels):
+    """Triangular scheme of de Boor (The NURBS Book, A2.2) at one site, in place.
+
+    Writes the p+1 basis functions nonzero in the span into N. If keep_levels, also writes
+    the basis functions of each order k = 0, ..., p into levels[k, p-k:].
+    """
+    N[0] = 1.
+    if keep_levels:
+        levels[0, p] = 1.
+    for j in range(1, p+1):
+        left[j]  = xi - tp[span+1-j]
+        right[j] = tp[span+j] - xi
+        saved    = 0.
+        for r in range(j):
+            temp  = N[r] / (right[r+1] + left[j-r])
+            N[r]  = saved + right[r+1] * temp
+            saved = left[j-r] * temp
+        N[j] = saved
+        if keep_levels:
+            for r in range(j+1):
+                levels[j, p-j+r] = N[r]
+
+
+@numba.njit(nogil=True, cache=True)
+def local_ders(tp, x, p, nderiv, t0, tend, nbasis, sorted_sites):
+    """Compiled equivalent of the NumPy path of `Bspline.__local`.
+
+    Parameters:
+        tp: rank-1 array, knot vector padded with p copies of each endpoint
+        x: rank-1 float array, sites; the results are of its dtype (float32 or float64)
+        p: int, order of the basis
+        nderiv: int, highest derivative order to compute
+        t0, tend: first and last knot
+        nbasis: int, number of basis functions
+        sorted_sites: bool, whether x is nondecreasing; then the knot span is tracked
+                      incrementally from site to site (amortized O(1)) instead of by binary search,
+                      starting from a binary search for the first site inside the range
+
+    Returns:
+        (ders, start) as in `Bspline.__local`.
+    """
+    n     = x.shape[0]
+    ders  = np.zeros( (n, nderiv+1, p+1), x.dtype )
+    start = np.empty( n, np.int64 )
+    left  = np.empty( p+1, x.dtype )
+    right = np.empty( p+1, x.dtype )
+    ndu   = np.empty( (p+1, p+1), x.dtype )
+    a     = np.empty( (2, p+1), x.dtype )
+    nolv  = np.empty( (1, 1), x.dtype )
+    nd    = min(nderiv, p)
+
+    # span of t0, used also for sites outside the range; span < 0 until the first inside site
+    span0 = _first_span(tp, t0)
+    span  = -1
+
+    for i in range(n):
+        xi     = x[i]
+        inside = (xi >= t0) and (xi < tend)
+        if not inside:
+            start[i] = span0 - 2*p
+            continue
+
+        span     = _find_span(tp, xi, span, sorted_sites)
+        start[i] = span - 2*p
+
+        if nderiv == 0:
+            # values only
+            _values(tp, span, xi, p, left, right, ders[i, 0], nolv, False)
+            for j in range(p+1):
+                c = start[i] + j
+                if c < 0  or  c >= nbasis:
+                    ders[i, 0, j] = 0.
+            continue
+
+        # basis functions of orders 0, ..., p, and knot differences (The NURBS Book, A2.3)
+        ndu[0, 0] = 1.
+        for j in range(1, p+1):
+            left[j]  = xi - tp[span+1-j]
+            right[j] = tp[span+j] - xi
+            saved    = 0.
+            for r in range(j):
+                ndu[j, r] = right[r+1] + left[j-r]
+                temp      = ndu[r, j-1] / ndu[j, r]
+                ndu[r, j] = saved + right[r+1] * temp
+                saved     = left[j-r] * temp
+            ndu[j, j] = saved
+        for j in range(p+1):
+            ders[i, 0, j] = ndu[j, p]
+
+        # derivatives
+        for r in range(p+1):
+            s1 = 0
+            s2 = 1
+            a[0, 0] = 1.
+            for k in range(1, nd+1):
+                d  = 0.
+                rk = r - k
+                pk = p - k
+                if r >= k:
+                    a[s2, 0] = a[s1, 0] / ndu[pk+1, rk]
+                    d        = a[s2, 0] * ndu[rk, pk]
+                j1 = 1 if rk >= -1 else -rk
+                j2 = k-1 if r-1 <= pk else p-r
+                for j in range(j1, j2+1):
+                    a[s2, j] = (a[s1, j] - a[s1, j-1]) / ndu[pk+1, rk+j]
+                    d       += a[s2, j] * ndu[rk+j, pk]
+                if r <= pk:
+                    a[s2, k] = -a[s1, k-1] / ndu[pk+1, r]
+                    d       += a[s2, k] * ndu[r, pk]
+                ders[i, k, r] = d
+                s1, s2 = s2, s1
+
+        fac = p
+        for k in range(1, nd+1):
+            for j in range(p+1):
+                ders[i, k, j] *= fac
+            fac *= (p - k)
+
+        # nonexistent basis functions (near the ends of an unclamped knot vector)
+        for j in range(p+1):
+            c = start[i] + j
+            if c < 0  or  c >= nbasis:
+                for k in range(nderiv+1):
+                    ders[i, k, j] = 0.
+
+    return ders, start
+
+
+@numba.njit(nogil=True, cache=True)
+def local_all_orders(tp, x, p, t0, tend, nknots, sorted_sites):
+    """Compiled equivalent of the NumPy path of `Bspline.local_basis_all_orders`.
+
+    Parameters:
+        tp, x, p, t0, tend, sorted_sites: as in `local_ders`
+        nknots: int, length of the knot vector (order q has nknots - q - 1 basis functions)
+
+    Returns:
+        (V, start) as in `Bspline.local_basis_all_orders`.
+    """
+    n     = x.shape[0]
+    V     = np.zeros( (n, p+1, p+1), x.dtype )
+    start = np.empty( n, np.int64 )
+    left  = np.empty( p+1, x.dtype )
+    right = np.empty( p+1, x.dtype )
+    N     = np.empty( p+1, x.dtype )
+
+    span0 = _first_span(tp, t0)
+    span  = -1
+    for i in range(n):
+        xi = x[i]
+        if not ((xi >= t0) and (xi < tend)):
+            start[i] = span0 - 2*p
+            continue
+        span     = _find_span(tp, xi, span, sorted_sites)
+        start[i] = span - 2*p
+        _values(tp, span, xi, p, left, right, N, V[i], True)
+
+        # nonexistent basis functions of each order
+        for q in range(p+1):
+            for j in range(p-q, p+1):
+                c = start[i] + j
+                if c < 0  or  c >= nknots - q - 1:
+                    V[i, q, j] = 0.
+
+    return V, start
+
+
+@numba.njit(nogil=True, cache=True)
+def uniform_ders(x, u, invh, spans, cardinal, Cd, p):
+    """Compiled equivalent of the uniform-knot fast path of `Bspline.__local`.
+
+    Parameters:
+        x: rank-1 float array, sites; the results are of its dtype (float32 or float64)
+        u, invh, spans, cardinal: as returned by `Bspline.__uniform_tables`
+        Cd: rank-3 array, Cd[k] holds the coefficients of D**k of the pieces
+            (in powers of the local coordinate, zero-padded to p+1 columns)
+        p: int, order of the basis
+
+    Returns:
+        (ders, start, sel), where sel is a boolean mask of the sites that were evaluated;
+        the others are left for the general path.
+    """
+    n     = x.shape[0]
+    nk    = Cd.shape[0]
+    nint  = u.shape[0] - 1
+    ders  = np.zeros( (n, nk, p+1), x.dtype )
+    start = np.empty( n, np.int64 )
+    sel   = np.zeros( n, np.bool_ )
+    S     = np.empty( p+1, x.dtype )
+
+    for i in range(n):
+        xi = x[i]
+        if not ((xi >= u[0]) and (xi < u[nint])):
+            start[i] = spans[0] - 2*p
+            continue
+        m = int( (xi - u[0]) * invh )
+        if m > nint - 1:
+            m = nint - 1
+        if m > 0  and  xi < u[m]:
+            m -= 1
+        elif m < nint - 1  and  xi >= u[m+1]:
+            m += 1
+        start[i] = spans[m] - 2*p
+        if not cardinal[m]:
+            continue
+        sel[i] = True
+
+        s    = (xi - u[m]) * invh
+        S[0] = 1.
+        for q in range(1, p+1):
+            S[q] = S[q-1] * s
+        for k in range(nk):
+            for j in range(p+1):
+                acc = 0.
+                for q in range(p+1-k):
+                    acc += Cd[k, j, q] * S[q]
+                ders[i, k, j] = acc
+
+    return ders, start, sel
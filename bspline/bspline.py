@@ -3,9 +3,63 @@
 
 from __future__ import division, print_function, absolute_import
 
+from collections import namedtuple, OrderedDict
 from functools import partial
+import importlib
+import math
 import numpy as np
 
+try:
+    from itertools import zip_longest
+except ImportError:  # Python 2
+    from itertools import izip_longest as zip_longest
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class LRUCache(object):
+    """A size-bounded cache with least-recently-used eviction, and hit/miss statistics.
+
+       maxsize: int or None. The maximum number of stored results; when full, the least recently
+                used entry is evicted. None means unbounded, and 0 disables caching
+                (every lookup is a miss, and nothing is stored).
+    """
+    def __init__(self, maxsize=None):
+        if maxsize is not None:
+            maxsize = int(maxsize)
+            if maxsize < 0:
+                raise ValueError("maxsize must be None or an integer >= 0, but got %d" % (maxsize))
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        """Remove all entries, and reset the statistics."""
+        self.data   = OrderedDict()
+        self.hits   = 0
+        self.misses = 0
+
+    def info(self):
+        """Return the statistics as a CacheInfo(hits, misses, maxsize, currsize) named tuple."""
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.data))
+
+    def lookup(self, key, compute):
+        """Return the cached value for `key`, calling `compute()` to produce (and store) it on a miss."""
+        data = self.data
+        try:
+            res = data.pop(key)
+        except KeyError:
+            self.misses += 1
+            res = compute()
+            if self.maxsize == 0:
+                return res
+            if self.maxsize is not None  and  len(data) >= self.maxsize:
+                data.popitem(last=False)  # evict least recently used
+        else:
+            self.hits += 1
+        data[key] = res  # (re-)insert as most recently used
+        return res
+
+
 class memoize(object):
     """Cache the return value of a method.
 
@@ -14,6 +68,10 @@ class memoize(object):
        was invoked. All arguments passed to a method decorated with memoize must
        be hashable.
 
+       The cache of each instance is an `LRUCache`, shared by all memoized methods of
+       that instance. It is unbounded unless created beforehand with a size limit,
+       by calling ``memoize.get_cache(obj, maxsize)``.
+
        If a memoized method is invoked directly on its class the result will not
        be cached. Instead the method will be invoked like a static method:
        class Obj(object):
@@ -34,24 +92,443 @@ class memoize(object):
             return self.func
         return partial(self, obj)
     def __call__(self, *args, **kw):
-        obj = args[0]
+        cache = memoize.get_cache(args[0])
+        key = (self.func, args[1:], frozenset(kw.items()))
+        return cache.lookup(key, lambda: self.func(*args, **kw))
+
+    @staticmethod
+    def get_cache(obj, maxsize=None):
+        """Return the LRUCache of `obj`, creating it with the given `maxsize` if it does not exist yet."""
         try:
             cache = obj.__cache
         except AttributeError:
-            cache = obj.__cache = {}
-        key = (self.func, args[1:], frozenset(kw.items()))
+            cache = obj.__cache = LRUCache(maxsize)
+        return cache
+
+
+def _local_to_csr(N, cols, nbasis):
+    """Assemble local basis values into a compressed sparse row (CSR) matrix (for internal use).
+
+    Parameters:
+        N: rank-2 array, N[i,j] is the value for site i in column cols[i,j]
+        cols: rank-2 int array of the same shape, column indices;
+              for `Bspline.local_basis` output, ``start[:,np.newaxis] + np.arange(p+1)``
+        nbasis: int, number of basis functions (number of columns)
+
+    Returns:
+        scipy.sparse.csr_matrix of shape (len(N), nbasis) if SciPy is available;
+        otherwise the tuple (data, indices, indptr, shape) of its CSR arrays.
+
+        Zero entries (including those that refer to nonexistent basis functions,
+        i.e. columns outside 0, 1, ..., nbasis-1) are dropped. The dense matrix is never formed.
+    """
+    n       = N.shape[0]
+    valid   = (cols >= 0) & (cols < nbasis) & (N != 0.)
+    data    = N[valid]
+    indices = cols[valid]
+    indptr  = np.concatenate( ([0], np.cumsum( np.sum(valid, axis=1) )) )
+    shape   = (n, nbasis)
+
+    try:
+        import scipy.sparse
+    except ImportError:
+        return (data, indices, indptr, shape)
+    return scipy.sparse.csr_matrix( (data, indices, indptr), shape=shape )
+
+
+def _cardinal_coefficients(p):
+    """Return the polynomial pieces of the uniform B-spline of order p (for internal use).
+
+    Row j of the returned (p+1, p+1) array holds the coefficients of s**0, ..., s**p of the basis
+    function number start+j of `Bspline.local_basis`, on a knot span of unit length between
+    uniform knots, as a function of the local coordinate s in [0, 1).
+    """
+    fact  = math.factorial
+    binom = lambda a, b: fact(a) // (fact(b) * fact(a - b))
+    C = np.zeros( (p+1, p+1) )
+    for j in range(p+1):
+        for k in range(p+1):
+            # (1/p!) sum_i (-1)**i binom(p+1,i) (s + p-j-i)**p, expanded in powers of s
+            C[j, k] = sum( (-1)**i * binom(p+1, i) * binom(p, k) * (p-j-i)**(p-k)
+                           for i in range(p-j+1) ) / fact(p)
+    return C
+
+
+def _falling_factorials(p, k):
+    """Return i!/(i-k)! for i = k, ..., p, as a float array (for internal use)."""
+    i   = np.arange(k, p+1)
+    out = np.ones( (p+1-k,) )
+    for q in range(k):
+        out *= i - q
+    return out
+
+
+def _integral_weights(t, p):
+    """Return the integrals (t[i+p+1] - t[i]) / (p+1) of the basis functions over the real line (for internal use)."""
+    return (t[p+1:] - t[:-p-1]) / (p+1)
+
+
+def _triangular_values(diffs, n, p, dtype, levels=None):
+    """Triangular scheme of de Boor for the basis functions nonzero in a knot span (for internal use).
+
+    Parameters:
+        diffs: function k -> (r, l) for the levels k = 1, ..., p, giving rank-2 arrays of shape (n, k)
+               of the knot differences  r[:,i] = right_{i+1} = t[span+1+i] - x  and
+               l[:,i] = left_{k-i} = x - t[span+k-i]  (x may depend on the level; see `Bspline.insert_knots`)
+        n: int, number of sites
+        p: int, order of the basis
+        dtype: dtype of the result
+        levels: None, or a rank-3 array of shape (n, p+1, p+1), into which the basis functions
+                of each order k = 0, ..., p are written, at levels[:, k, p-k:]
+
+    Returns:
+        rank-2 array of shape (n, p+1), the basis functions of order p.
+    """
+    N = np.ones( (n, 1), dtype=dtype )
+    if levels is not None:
+        levels[:, 0, p] = 1.
+    for k in range(1, p+1):
+        r, l = diffs(k)
+        temp = N / (r + l)
+        N    = np.concatenate( (r * temp, np.zeros( (n, 1), dtype=dtype )), axis=1 )
+        N[:, 1:] += l * temp
+        if levels is not None:
+            levels[:, k, p-k:] = N
+    return N
+
+
+def _is_sorted(x):
+    """Return whether the rank-1 array x is nondecreasing, at O(len(x)) cost (for internal use).
+
+    Sorted sites (e.g. time series, or ``np.linspace`` in `Bspline.plot`) allow a linear-time
+    merge with the knots instead of a binary search for each site.
+    """
+    return x.shape[0] > 1  and  bool( np.all(x[1:] >= x[:-1]) )
+
+
+def _csr_dot(A, c):
+    """Multiply a matrix returned by `_local_to_csr` by the dense array c (for internal use).
+
+    Works both for a scipy.sparse matrix and for the tuple (data, indices, indptr, shape).
+    """
+    if not isinstance(A, tuple):
+        return A.dot(c)
+    data, indices, indptr, shape = A
+    rows = np.repeat( np.arange(shape[0]), np.diff(indptr) )
+    data = data.reshape( data.shape + (1,)*(c.ndim - 1) )
+    out  = np.zeros( (shape[0],) + c.shape[1:], dtype=np.result_type(data, c) )
+    np.add.at( out, rows, data * c[indices] )
+    return out
+
+
+# Evaluation backend for the local-support engine; see `set_backend`.
+_backend = "auto"
+_kernels = None  # compiled kernel module once loaded, False if unavailable
+
+
+def _load_kernels():
+    """Return the compiled (Numba) kernel module, or None if Numba is not installed (for internal use)."""
+    global _kernels
+    if _kernels is None:
         try:
-            res = cache[key]
-        except KeyError:
-            res = cache[key] = self.func(*args, **kw)
-        return res
+            from . import _numba_kernels
+        except ImportError:
+            _kernels = False
+        else:
+            _kernels = _numba_kernels
+    return _kernels or None
+
+
+def _get_kernels():
+    """Return the kernel module to use according to the selected backend, or None for NumPy (for internal use)."""
+    if _backend == "numpy":
+        return None
+    return _load_kernels()
+
+
+def set_backend(name):
+    """Select the backend of the local-support evaluation engine (see `Bspline.local_basis`).
+
+    The backend is used for all batched evaluation, collocation and fitting.
+
+    Parameters:
+        name: str, one of
+            "numba": compiled loop over sites (requires Numba; raises ImportError if not installed).
+                     The first call compiles the kernel, which takes a few seconds; the result
+                     is cached on disk for later sessions.
+            "numpy": vectorized NumPy, always available.
+            "auto":  "numba" if Numba is installed, else "numpy" (the default).
+    """
+    global _backend
+    if name not in ("auto", "numpy", "numba"):
+        raise ValueError("backend must be one of 'auto', 'numpy', 'numba', but got '%s'" % (name))
+    if name == "numba"  and  _load_kernels() is None:
+        raise ImportError("backend 'numba' requires Numba, which is not installed")
+    _backend = name
+
 
+def get_backend():
+    """Return the name of the backend in effect: "numba" or "numpy". See `set_backend`."""
+    return "numpy" if _get_kernels() is None else "numba"
+
+
+# Minimum number of sites per worker thread for parallel evaluation to be worth its overhead.
+PARALLEL_MIN_SITES = 4096
+
+
+def _parallel_ranges(n, workers, func):
+    """Call func(a, b) for contiguous ranges [a, b) covering range(n) (for internal use).
+
+    If `workers` > 1 and there are enough sites (see `PARALLEL_MIN_SITES`), the ranges are
+    processed on a pool of `workers` threads; otherwise func(0, n) is called directly.
+
+    Threads share memory, so `func` should write its results directly into slices of
+    preallocated output arrays; nothing is pickled or copied back. NumPy releases
+    the GIL inside its array operations, so the threads run concurrently.
+    """
+    workers = min( int(workers), n // PARALLEL_MIN_SITES )
+    if workers <= 1:
+        func(0, n)
+        return
+
+    from multiprocessing.pool import ThreadPool
+    bounds = np.linspace(0, n, workers + 1).astype(int)
+    pool   = ThreadPool(workers)
+    try:
+        pool.map( lambda ab: func(*ab), zip(bounds[:-1], bounds[1:]) )
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _chunks(a, chunksize):
+    """Yield a sequence of sites (or data) in pieces of at most `chunksize` items (for internal use).
+
+    `a` may be an array (including a `numpy.memmap`, e.g. from ``np.load(filename, mmap_mode='r')``),
+    in which case it is sliced along its first axis, so that only one piece at a time is read
+    into memory. A Python list or tuple is treated as an array. Otherwise `a` is treated as
+    an iterable of arrays (e.g. a generator reading a file piece by piece), and each of them
+    is split further if longer than `chunksize`.
+    """
+    chunksize = int(chunksize)
+    if chunksize < 1:
+        raise ValueError("chunksize must be >= 1, but got %d" % (chunksize))
+
+    if hasattr(a, "shape")  or  isinstance(a, (list, tuple)):
+        pieces = (a,)
+    else:
+        pieces = a
+    for piece in pieces:
+        piece = np.atleast_1d(piece)
+        for i in range(0, piece.shape[0], chunksize):
+            yield np.asarray( piece[i:(i + chunksize)] )
+
+
+def _banded_gram(N, start, nbasis, w=None):
+    """Assemble the Gram matrix A^T W A of local basis values in banded form (for internal use).
+
+    Parameters:
+        N, start: as returned by `Bspline.local_basis` for a rank-1 array of sites
+        nbasis: int, number of basis functions
+        w: rank-1 array of weights, one per site, or None (unit weights)
+
+    Returns:
+        rank-2 array ab of shape (p+1, nbasis), the upper band of the symmetric matrix
+        in the storage format of `scipy.linalg.solveh_banded`:
+            ab[p + i - j, j] = (A^T W A)[i,j],   j-p <= i <= j
+    """
+    n, q  = N.shape
+    p     = q - 1
+    cols  = start[:, np.newaxis] + np.arange(q)
+    valid = (cols >= 0) & (cols < nbasis)
+    Nw    = N if w is None else N * w[:, np.newaxis]
+
+    ab = np.zeros( (q, nbasis), dtype=np.result_type(N, Nw) )
+    for r in range(q):
+        for c in range(r, q):  # entry (cols[:,r], cols[:,c]) lies on superdiagonal c-r
+            ok = valid[:, r] & valid[:, c]
+            # np.add.at instead of np.bincount, which sums only in float64
+            np.add.at( ab[p - (c - r)], cols[ok, c], Nw[ok, r] * N[ok, c] )
+    return ab
+
+
+def _banded_to_dense(ab):
+    """Expand the upper band of a symmetric matrix (format of `_banded_gram`) into a dense array (for internal use)."""
+    u, n = ab.shape[0] - 1, ab.shape[1]
+    A    = np.zeros( (n, n), dtype=ab.dtype )
+    for d in range(u + 1):  # superdiagonal d
+        j = np.arange(d, n)
+        A[j - d, j] = ab[u - d, d:]
+        A[j, j - d] = ab[u - d, d:]
+    return A
+
+
+def _solveh_banded(ab, b):
+    """Solve a symmetric positive definite banded system (for internal use).
+
+    `ab` is the upper band in the storage format of `scipy.linalg.solveh_banded`,
+    which is used if SciPy is available and the dtype is at most double precision
+    (LAPACK computes in float64 at most). Otherwise, a banded Cholesky factorization
+    is computed here, at O(n * bandwidth**2) cost, in the dtype of ab and b.
+    """
+    if np.can_cast( np.result_type(ab, b), np.float64 ):
+        try:
+            import scipy.linalg
+        except ImportError:
+            pass
+        else:
+            return scipy.linalg.solveh_banded(ab, b)
+
+    u = ab.shape[0] - 1
+    n = ab.shape[1]
+    U = np.zeros_like(ab, dtype=np.result_type(ab, 1.))  # Cholesky factor A = U^T U, same storage as ab
+    for j in range(n):
+        i0 = max(0, j - u)
+        for i in range(i0, j):
+            # U[i,j] = (A[i,j] - sum_k U[k,i] U[k,j]) / U[i,i],  k = i0, ..., i-1
+            k = np.arange(i0, i)
+            U[u + i - j, j] = (ab[u + i - j, j] - np.dot(U[u + k - i, i], U[u + k - j, j])) / U[u, i]
+        k = np.arange(i0, j)
+        d = ab[u, j] - np.dot(U[u + k - j, j], U[u + k - j, j])
+        if not (d > 0.):
+            raise np.linalg.LinAlgError("matrix is not positive definite (leading minor %d)" % (j + 1))
+        U[u, j] = np.sqrt(d)
+
+    x = np.array(b, dtype=np.result_type(U, b))
+    for j in range(n):  # U^T z = b
+        k = np.arange(max(0, j - u), j)
+        x[j] = (x[j] - np.dot(U[u + k - j, j], x[k])) / U[u, j]
+    for i in range(n - 1, -1, -1):  # U x = z
+        k = np.arange(i + 1, min(n, i + u + 1))
+        x[i] = (x[i] - np.dot(U[u + i - k, k], x[k])) / U[u, i]
+    return x
+
+
+class NormalEquations(object):
+    """Normal equations of a (weighted) least-squares fit in a B-spline basis, in banded form.
+
+    For sites x_i, data y_i and weights w_i, the coefficients c minimizing
+    sum_i w_i (sum_j c_j B_j(x_i) - y_i)**2 solve
+
+        (A^T W A) c = A^T W y,
+
+    where A is the collocation matrix. A^T W A is symmetric and banded with bandwidth p,
+    so it is accumulated directly in banded form, from the local basis values, and solved
+    by a banded Cholesky factorization in O(n_basis * p**2). Neither A nor the dense
+    A^T W A is formed.
+
+    Data may be added in several batches (see `add`) before solving. The system is accumulated
+    in the attribute `dtype`, np.result_type(basis.dtype, np.float64).
+    """
+
+    def __init__(self, basis):
+        """Create an empty system for the Bspline object `basis`."""
+        self.basis = basis
+        self.dtype = np.result_type(basis.dtype, np.float64)  # accumulate in at least double precision
+        self.ab    = np.zeros( (basis.p + 1, basis.n_basis), dtype=self.dtype )  # A^T W A, upper band (see `_banded_gram`)
+        self.rhs   = None                                     # A^T W y; shape set by the first `add`
+
+    def add(self, x, y, w=None):
+        """Accumulate data into the normal equations.
+
+        Parameters:
+            x: Python list or rank-1 array, sites
+            y: rank-1 array of data values at the sites, or rank-2 array of shape (len(x), m)
+               for m-valued data (fitted simultaneously)
+            w: Python list or rank-1 array of nonnegative weights, or None (unit weights)
+        """
+        x = np.atleast_1d(x)
+        if x.ndim > 1:
+            raise ValueError("x must be a list or a rank-1 array")
+        y = np.asanyarray(y)
+        if y.ndim not in (1, 2)  or  y.shape[0] != x.shape[0]:
+            raise ValueError("y must have one row per site (%d), but got shape %s" % (x.shape[0], y.shape))
+        if w is not None:
+            w = np.atleast_1d(w)
+            if w.shape != x.shape:
+                raise ValueError("w must have one element per site (%d), but got shape %s" % (x.shape[0], w.shape))
+
+        N, start = self.basis.local_basis(x)
+        self.add_local(N, start, y, w)
+
+    def add_local(self, N, start, y, w=None):
+        """Accumulate data into the normal equations, given precomputed local basis values.
+
+        This allows rows other than plain function values, e.g. derivatives
+        (see `Bspline.local_basis`).
+
+        Parameters:
+            N, start: as returned by `Bspline.local_basis` for a rank-1 array of sites
+            y, w: as in `add`
+        """
+        y = np.asanyarray(y)
+        if self.rhs is None:
+            self.rhs = np.zeros( (self.basis.n_basis,) + y.shape[1:], dtype=self.dtype )
+        elif self.rhs.shape[1:] != y.shape[1:]:
+            raise ValueError("y must have shape (npoints,) + %s to match earlier data, but got %s" % (self.rhs.shape[1:], y.shape))
+
+        self.ab += _banded_gram(N, start, self.basis.n_basis, w)
+
+        # A^T W y
+        Nw    = N if w is None else N * w[:, np.newaxis]
+        cols  = start[:, np.newaxis] + np.arange(self.basis.p + 1)
+        valid = (cols >= 0) & (cols < self.basis.n_basis)
+        rows  = np.nonzero(valid)[0]
+        np.add.at( self.rhs, cols[valid], (Nw[valid] * y[rows].T).T )
+
+    def add_chunks(self, x, y, w=None, chunksize=65536):
+        """Accumulate data into the normal equations in chunks, with memory bounded by the chunk size.
+
+        Parameters:
+            x, y, w: as in `add`, but each may also be a memory-mapped array (e.g. from
+                     ``np.load(filename, mmap_mode='r')``), or an iterator yielding consecutive
+                     pieces of the data. Pieces of x, y and w must correspond to each other.
+            chunksize: int, maximum number of sites processed at a time
+
+        Raises ValueError if x, y and w do not have the same number of items (detected when the
+        shortest of them runs out; the chunks accumulated until then are kept).
+        """
+        streams = [ _chunks(x, chunksize), _chunks(y, chunksize) ]
+        if w is not None:
+            streams.append( _chunks(w, chunksize) )
+
+        missing = object()
+        for pieces in zip_longest(*streams, fillvalue=missing):
+            if any( piece is missing for piece in pieces ):
+                raise ValueError("x, y%s must have the same length" % (" and w" if w is not None else ""))
+            self.add(*pieces)
+
+    def solve(self, lam=0., penalty_order=2):
+        """Solve the normal equations. Return the fitted Spline.
+
+        Parameters:
+            lam: float, >= 0, weight of the roughness penalty. If lam > 0, the penalized
+                 least-squares problem (smoothing spline)
+
+                     minimize  sum_i w_i (f(x_i) - y_i)**2  +  lam * integral (D**penalty_order f)**2
+
+                 is solved instead, by adding lam times the banded Gram matrix of `Bspline.gram`
+                 to the system. The accumulated data are not modified.
+            penalty_order: int, >= 0, order of the derivative in the penalty
+
+        Raises numpy.linalg.LinAlgError (or the SciPy equivalent) if the system is singular,
+        e.g. if some basis function has no data within its support (and lam = 0).
+        """
+        if self.rhs is None:
+            raise ValueError("no data has been added")
+        if lam < 0:
+            raise ValueError("lam must be >= 0, but got %g" % (lam))
+
+        ab = self.ab
+        if lam > 0:
+            ab = ab + lam * self.basis.gram(penalty_order)
+        return Spline( self.basis, _solveh_banded(ab, self.rhs) )
 
 
 class Bspline():
     """Numpy implementation of Cox - de Boor algorithm in 1D."""
 
-    def __init__(self, knot_vector, order):
+    def __init__(self, knot_vector, order, cache_size=1024, workers=1, dtype=None):
         """Create a Bspline object.
 
         Parameters:
@@ -59,14 +536,47 @@ class Bspline():
                          entries
             order: Order of interpolation, e.g. 0 -> piecewise constant between
                    knots, 1 -> piecewise linear between knots, etc.
+            cache_size: Maximum number of memoized scalar evaluations (of `__call__` and `d`)
+                        kept by this instance, with least-recently-used eviction.
+                        None means unbounded, and 0 turns memoization off.
+                        See `cache_info`.
+            workers: Number of threads (integer >= 1) for batched evaluation (evaluation at arrays of
+                     sites, including collocation matrices). The default 1 means no parallelism.
+                     Can also be changed later via the attribute `workers`.
+            dtype: None, or a NumPy floating-point dtype (e.g. np.float32) in which to compute.
+                   If given, the knot vector is converted to it, sites are converted to it on
+                   evaluation, and all results (including the output arrays of batched evaluation,
+                   which are allocated in it) are of this dtype. The compiled kernels (see
+                   `set_backend`) support float32 and float64; other dtypes use the NumPy path.
+                   Fitting (`NormalEquations`, `splinelab.spap2`, `splinelab.spapi`) in a dtype wider
+                   than float64 (np.longdouble) solves by a banded Cholesky factorization in NumPy
+                   instead of LAPACK, which computes in float64 at most.
+                   The default None computes in np.result_type(knot_vector.dtype, np.float64).
+
+                   Accuracy: the local recursion forms convex combinations, so the values of the
+                   basis functions at the (rounded) site are accurate to a few multiples of p * eps
+                   (eps = np.finfo(dtype).eps, about 1.2e-7 for float32). Rounding the knots and
+                   sites to the dtype moves them by up to eps * |x|, which changes the values by up
+                   to about p * eps * |x| / h, where h is the length of the local knot spans; keep
+                   the knots in a range comparable to their spacing (e.g. shifted to start at 0)
+                   for float32. Derivatives of order k are accurate to about the same relative
+                   amount, times (p / h)**k in absolute terms.
 
         Returns:
             Bspline object, callable to evaluate basis functions at given
             values of `x` inside the knot span.
+
+            The attributes `n_basis` (number of basis functions) and `dtype`
+            (dtype of the evaluation results) are available without evaluating anything.
         """
         kv = np.atleast_1d(knot_vector)
         if kv.ndim > 1:
             raise ValueError("knot_vector must be Python list or rank-1 array, but got rank = %d" % (kv.ndim))
+        if dtype is not None:
+            dtype = np.dtype(dtype)
+            if not np.issubdtype(dtype, np.floating):
+                raise ValueError("dtype must be a floating-point dtype, but got %s" % (dtype))
+            kv = kv.astype(dtype, copy=False)
         self.knot_vector = kv
 
         order = int(order)
@@ -75,15 +585,90 @@ class Bspline():
 
         self.p = order
 
-        #Dummy calls to the functions for memory storage
-        self.__call__(0.0)
-        self.d(0.0)
+        memoize.get_cache(self, cache_size)
 
+        # Number of basis functions, and dtype of the evaluation results.
+        #
+        # Anything more expensive is precomputed lazily, on first use.
+        #
+        self.n_basis = max(kv.shape[0] - order - 1, 0)
+        self.dtype   = np.result_type(kv.dtype, np.float64) if dtype is None else dtype
+
+        try:
+            workers = int(workers)
+        except (TypeError, ValueError):
+            raise ValueError("workers must be integer >= 1, but got %r" % (workers,))
+        if workers < 1:
+            raise ValueError("workers must be integer >= 1, but got %d" % (workers))
+
+        self.workers = workers
+
+
+    def cache_info(self):
+        """Return statistics of the memoization cache of this instance.
+
+        Returns:
+            CacheInfo(hits, misses, maxsize, currsize) named tuple, like `functools.lru_cache`.
+        """
+        return memoize.get_cache(self).info()
+
+    def cache_clear(self):
+        """Empty the memoization cache of this instance, and reset its statistics."""
+        memoize.get_cache(self).clear()
+
+    def __padded_knots(self):
+        """Return the knot vector padded with p extra copies of each endpoint (for internal use).
+
+        With the padding, every knot span has p knots on each side, which the local-support
+        evaluation engine (see `local_basis`) needs. Computed on first use, then cached.
+        """
+        try:
+            return self.__tpad
+        except AttributeError:
+            kv, p = self.knot_vector, self.p
+            tpad  = self.__tpad = np.concatenate( (np.repeat(kv[:1], p), kv, np.repeat(kv[-1:], p)) )
+            return tpad
+
+    def __kernels(self):
+        """Return the compiled kernel module for this instance, or None for the NumPy path (for internal use).
+
+        The kernels are compiled for float32 and float64 sites; other dtypes always use NumPy.
+        """
+        if self.dtype not in (np.float32, np.float64):
+            return None
+        return _get_kernels()
+
+    def __reciprocal_knot_differences(self):
+        """Return the reciprocal denominators used in `__basis` (for internal use).
+
+        Item k of the returned list (k = 1, ..., p) is the rank-1 array
+        ``1 / (knot_vector[k:] - knot_vector[:-k])``, where zero-length intervals
+        give 0 instead of infinity (so that the corresponding terms of the
+        recursion vanish). Computed on first use, then cached.
+        """
+        try:
+            return self.__rdiff
+        except AttributeError:
+            kv    = self.knot_vector
+            rdiff = [None]
+            for k in range(1, self.p + 1):
+                diff = kv[k:] - kv[:-k]
+                with np.errstate(divide='ignore'):  # zero-length intervals are masked out
+                    rdiff.append( np.where(diff != 0, 1. / diff, 0.) )
+            self.__rdiff = rdiff
+            return rdiff
+
+    def __sites(self, xi):
+        """Convert a scalar or rank-1 array of sites into a rank-1 array of dtype `dtype`, for batched evaluation (for internal use)."""
+        xi = np.atleast_1d(xi)
+        if xi.ndim > 1:
+            raise ValueError("xi must be a scalar or a rank-1 array, but got rank = %d" % (xi.ndim))
+        return xi.astype(self.dtype, copy=False)
 
     def __basis0(self, xi):
         """Order zero basis (for internal use)."""
-        return np.where(np.all([self.knot_vector[:-1] <=  xi,
-                                xi < self.knot_vector[1:]],axis=0), 1.0, 0.0)
+        return np.all([self.knot_vector[:-1] <=  xi,
+                       xi < self.knot_vector[1:]],axis=0).astype(self.dtype)
 
     def __basis(self, xi, p, compute_derivatives=False):
         """Recursive Cox - de Boor function (for internal use).
@@ -96,13 +681,11 @@ class Bspline():
         else:
             basis_p_minus_1 = self.__basis(xi, p - 1)
 
-        first_term_numerator = xi - self.knot_vector[:-p]
-        first_term_denominator = self.knot_vector[p:] - self.knot_vector[:-p]
+        # 1 / (knot_vector[p:] - knot_vector[:-p]), with zero-length intervals mapped to 0
+        reciprocal_denominator = self.__reciprocal_knot_differences()[p]
 
+        first_term_numerator = xi - self.knot_vector[:-p]
         second_term_numerator = self.knot_vector[(p + 1):] - xi
-        second_term_denominator = (self.knot_vector[(p + 1):] -
-                                   self.knot_vector[1:-p])
-
 
         #Change numerator in last recursion if derivatives are desired
         if compute_derivatives and p == self.p:
@@ -110,28 +693,516 @@ class Bspline():
             first_term_numerator = p
             second_term_numerator = -p
 
-        #Disable divide by zero error because we check for it
-        with np.errstate(divide='ignore', invalid='ignore'):
-            first_term = np.where(first_term_denominator != 0.0,
-                                  (first_term_numerator /
-                                   first_term_denominator), 0.0)
-            second_term = np.where(second_term_denominator != 0.0,
-                                   (second_term_numerator /
-                                    second_term_denominator), 0.0)
+        first_term = first_term_numerator * reciprocal_denominator
+        second_term = second_term_numerator * reciprocal_denominator[1:]
 
         return  (first_term[:-1] * basis_p_minus_1[:-1] +
                  second_term * basis_p_minus_1[1:])
 
+    def __find_span(self, x):
+        """Locate the knot span of each site, by a linear merge if the sites are sorted and at least as
+        many as the knots, else by binary search (for internal use).
+
+        Returns (span, inside), where `span` indexes the padded knot vector such that
+        ``tpad[span] <= x < tpad[span+1]`` with a nonzero-length interval, and `inside` is
+        a boolean mask of the sites that lie inside the half-open range [t[0], t[-1]).
+
+        Sites outside the range are placed into the first nonzero-length span
+        so that the computation stays well-defined; their results must be discarded.
+        """
+        t      = self.knot_vector
+        tp     = self.__padded_knots()
+        inside = (x >= t[0]) & (x < t[-1])
+        if x.shape[0] >= tp.shape[0]  and  _is_sorted(x):
+            # merge: span[i] + 1 = number of knots <= x[i] = number of knots whose first site >= the
+            # knot is at or before i; linear in the number of sites instead of a search per site.
+            # It searches each knot among the sites, so with fewer sites than knots, the binary
+            # search of each site among the knots below is cheaper.
+            first = np.searchsorted(x, tp, side='left')
+            span  = np.cumsum( np.bincount(first, minlength=x.shape[0] + 1)[:x.shape[0]] ) - 1
+            span[~inside] = np.searchsorted(tp, t[0], side='right') - 1
+        else:
+            x    = np.where(inside, x, t[0])
+            span = np.searchsorted(tp, x, side='right') - 1
+        return span, inside
+
+    def __uniform_tables(self):
+        """Return the tables of the uniform-knot fast path, or None (for internal use).
+
+        If the distinct knots are equispaced, the interval containing a site is found by one
+        floor division, and in the intervals where the surrounding 2p knots are all distinct
+        and equispaced, the nonzero basis functions are fixed polynomials (pieces of the
+        cardinal B-spline) of the local coordinate. Computed on first use, then cached.
+
+        Returns:
+            None if the distinct knots are not equispaced (up to rounding), or no interval
+            qualifies; otherwise the tuple (u, invh, span, cardinal, C), where u are the distinct
+            knots, invh = 1/spacing, span[m] is the index of interval m in the padded knot vector,
+            cardinal[m] tells whether interval m can use the polynomial table C of
+            `_cardinal_coefficients`.
+        """
+        try:
+            return self.__unif
+        except AttributeError:
+            # assigned only once complete, so that concurrent `workers` threads never see partial state
+            unif = self.__unif = self.__compute_uniform_tables()
+            return unif
+
+    def __compute_uniform_tables(self):
+        """Compute the return value of `__uniform_tables` (for internal use)."""
+        p, t, nbasis = self.p, self.knot_vector, self.n_basis
+        u = np.unique(t)
+        if nbasis == 0  or  len(u) < 2:
+            return None
+
+        h   = (u[-1] - u[0]) / (len(u) - 1)
+        tol = 8. * np.finfo(self.dtype).eps * max( abs(u[0]), abs(u[-1]) )
+        if np.any( np.abs( np.diff(u) - h ) > tol ):
+            return None
+
+        # the 2p knots around each interval must be consecutive multiples of h,
+        # and all p+1 basis functions nonzero there must exist
+        tp     = self.__padded_knots()
+        span   = np.searchsorted( tp, u[:-1], side='right' ) - 1
+        lo, hi = span - p + 1, span + p
+        ok     = (lo - p >= 0) & (hi - p < len(t))
+        window = tp[ np.clip( lo[:, np.newaxis] + np.arange(2*p), 0, len(tp)-1 ) ]
+        expect = u[:-1, np.newaxis] + h * np.arange(-p+1, p+1)
+        cardinal = ok & np.all( np.abs(window - expect) <= tol, axis=1 )
+        cardinal &= (span - 2*p >= 0) & (span - p < nbasis)
+        if not np.any(cardinal):
+            return None
+
+        return (u, self.dtype.type(1. / h), span, cardinal, _cardinal_coefficients(p).astype(self.dtype))
+
+    def __local(self, x, nderiv=0):
+        """Local-support evaluation (for internal use). Same interface as `__local_general`.
+
+        Sites in intervals where the knots are uniform (see `__uniform_tables`) are located by one
+        floor division, and evaluated from the precomputed polynomial table (powers of the local
+        coordinate times the table); all other sites are passed on to `__local_general`.
+        The sites are converted to `dtype` first, and the results are of that dtype.
+        """
+        x    = np.asarray(x, dtype=self.dtype)
+        unif = self.__uniform_tables()
+        if unif is None:
+            return self.__local_general(x, nderiv)
+
+        u, invh, spans, cardinal, C = unif
+        p = self.p
+        n = x.shape[0]
+
+        kernels = self.__kernels()
+        if kernels is not None:
+            nd = min(nderiv, p)
+            Cd = np.zeros( (nd+1, p+1, p+1), dtype=self.dtype )
+            for k in range(nd+1):
+                Cd[k, :, :p+1-k] = C[:, k:] * (_falling_factorials(p, k) * invh**k)
+            d, start, sel = kernels.uniform_ders( x, u, invh, spans, cardinal, Cd, p )
+            if nderiv > nd:
+                d = np.concatenate( (d, np.zeros( (n, nderiv - nd, p+1), dtype=self.dtype )), axis=1 )
+            if not np.all(sel):
+                rest = np.nonzero(~sel)[0]
+                d[rest], start[rest] = self.__local_general(x[rest], nderiv)
+            return d, start
+
+        nint = len(u) - 1
+        m    = np.floor( (x - u[0]) * invh )
+        m    = np.clip( np.where(np.isfinite(m), m, 0), 0, nint-1 ).astype(np.intp)
+        m   -= (x < u[m]) & (m > 0)           # correct rounding errors of the division
+        m   += (x >= u[m+1]) & (m < nint-1)
+
+        sel   = cardinal[m] & (x >= u[0]) & (x < u[-1])
+        ders  = np.zeros( (n, nderiv+1, p+1), dtype=self.dtype )
+        start = spans[m] - 2*p
+        if not np.all(sel):
+            rest = np.nonzero(~sel)[0]
+            ders[rest], start[rest] = self.__local_general(x[rest], nderiv)
+            sel  = np.nonzero(sel)[0]
+            m    = m[sel]
+        else:
+            sel  = slice(None)
+
+        # powers s**0, ..., s**p of the local coordinate, then D**k of the pieces as one matrix product
+        # with the coefficients  C[:,i] * i!/(i-k)! / h**k  of s**(i-k)
+        s = (x[sel] - u[m]) * invh
+        S = np.empty( (len(m), p+1), dtype=self.dtype )
+        S[:, 0] = 1.
+        for i in range(1, p+1):
+            np.multiply( S[:, i-1], s, out=S[:, i] )
+
+        scale = 1.
+        for k in range( min(nderiv, p) + 1 ):
+            Ck = (C[:, k:] * (_falling_factorials(p, k) * scale)).astype(self.dtype, copy=False)
+            ders[sel, k] = np.dot( S[:, :p+1-k], Ck.T )
+            scale *= invh
+
+        return ders, start
+
+    def __local_general(self, x, nderiv=0):
+        """Local-support Cox - de Boor evaluation (for internal use).
+
+        Compute only the p+1 basis functions that are nonzero in the knot span of each site,
+        by the triangular scheme of de Boor, at O(p**2) cost per site. If `nderiv` > 0, also
+        compute their derivatives up to order `nderiv` from the same triangular table
+        (The NURBS Book, algorithm A2.3).
+
+        Parameters:
+            x: rank-1 array of sites
+            nderiv: int, >= 0, highest derivative order to compute
+
+        Returns:
+            (ders, start), where ders is a rank-3 array of shape (len(x), nderiv+1, p+1), and start
+            is a rank-1 int array such that ders[i,k,j] = D**k B_{start[i]+j}(x[i]). Entries that
+            correspond to sites outside the knot vector, or to basis functions that do not exist
+            (index < 0 or >= number of basis functions), are zero.
+        """
+        p      = self.p
+        tp     = self.__padded_knots()
+        t      = self.knot_vector
+        n      = x.shape[0]
+        nbasis = self.n_basis
+
+        if nbasis == 0  or  not (t[-1] > t[0]):  # no basis functions, or no nonzero-length span
+            return np.zeros( (n, nderiv+1, p+1), dtype=self.dtype ), np.zeros( (n,), dtype=int )
+
+        kernels = self.__kernels()
+        if kernels is not None:
+            return kernels.local_ders( tp, x, p, nderiv, t[0], t[-1], nbasis, _is_sorted(x) )
+
+        span, inside = self.__find_span(x)
+        x = np.where(inside, x, t[0])[:, np.newaxis]
+
+        # left[:,j-1] = x - t[span+1-j],  right[:,j-1] = t[span+j] - x,  j = 1, ..., p
+        #
+        # In a nonzero-length span, all denominators below are > 0.
+        #
+        j     = np.arange(1, p+1)
+        left  = x - tp[span[:, np.newaxis] + 1 - j]
+        right = tp[span[:, np.newaxis] + j] - x
+
+        ders = np.zeros( (n, nderiv+1, p+1), dtype=self.dtype )
+        if nderiv == 0:
+            # values only; no need to keep the lower orders
+            ders[:, 0, :] = _triangular_values( lambda k: (right[:, :k], left[:, k-1::-1]), n, p, self.dtype )
+
+        else:
+            # ndu[:,r,k] (r <= k): the order-k basis functions nonzero in the span,
+            # ndu[:,k,r] (r < k):  the knot differences used as denominators at order k.
+            ndu = np.empty( (n, p+1, p+1), dtype=self.dtype )
+            ndu[:, 0, 0] = 1.
+            for k in range(1, p+1):
+                r    = right[:, :k]
+                l    = left[:, k-1::-1]
+                ndu[:, k, :k] = r + l
+                temp = ndu[:, :k, k-1] / ndu[:, k, :k]
+                ndu[:, :k, k]  = r * temp
+                ndu[:, k, k]   = 0.
+                ndu[:, 1:k+1, k] += l * temp
+            ders[:, 0, :] = ndu[:, :, p]
+
+            # derivatives; those of order > p are identically zero
+            nd = min(nderiv, p)
+            a  = np.empty( (2, n, nd+1), dtype=self.dtype )
+            for r in range(p+1):
+                s1, s2 = 0, 1
+                a[s1, :, 0] = 1.
+                for k in range(1, nd+1):
+                    rk = r - k
+                    pk = p - k
+                    d  = np.zeros( (n,), dtype=self.dtype )
+                    if r >= k:
+                        a[s2, :, 0] = a[s1, :, 0] / ndu[:, pk+1, rk]
+                        d += a[s2, :, 0] * ndu[:, rk, pk]
+                    j1 = 1 if rk >= -1 else -rk
+                    j2 = k-1 if r-1 <= pk else p-r
+                    if j2 >= j1:
+                        jj = np.arange(j1, j2+1)
+                        a[s2, :, j1:j2+1] = (a[s1, :, j1:j2+1] - a[s1, :, j1-1:j2]) / ndu[:, pk+1, rk+jj]
+                        d += np.sum( a[s2, :, j1:j2+1] * ndu[:, rk+jj, pk], axis=1 )
+                    if r <= pk:
+                        a[s2, :, k] = -a[s1, :, k-1] / ndu[:, pk+1, r]
+                        d += a[s2, :, k] * ndu[:, r, pk]
+                    ders[:, k, r] = d
+                    s1, s2 = s2, s1
+
+            fac = p
+            for k in range(1, nd+1):
+                ders[:, k, :] *= fac
+                fac *= (p - k)
+
+        start = span - 2*p  # index in tpad -> index in knot_vector, then first nonzero basis function
+        cols  = start[:, np.newaxis] + np.arange(p+1)
+        bad   = (cols < 0) | (cols >= nbasis) | ~inside[:, np.newaxis]
+        ders[ np.broadcast_to( bad[:, np.newaxis, :], ders.shape ) ] = 0.
+
+        return ders, start
+
+    def __dense(self, N, start, out=None):
+        """Scatter the output of `__local` into a dense array (for internal use).
+
+        N has shape (n, ..., p+1); the output has shape (n, ..., number of basis functions).
+        If `out` is given, it must be zero-filled; the result is written into it.
+        """
+        if out is None:
+            out = np.zeros( N.shape[:-1] + (self.n_basis,), dtype=N.dtype )
+        cols  = start[:, np.newaxis] + np.arange(self.p + 1)
+        valid = (cols >= 0) & (cols < self.n_basis)
+        rows, j = np.nonzero(valid)
+        out[rows, ..., cols[valid]] = N[rows, ..., j]
+        return out
+
+    def __batch(self, xi, nderiv, k=None, dense=False):
+        """Batched evaluation at a rank-1 array of sites (for internal use).
+
+        The sites are split across `workers` threads (see `_parallel_ranges`), each writing
+        into its own rows of preallocated output arrays.
+
+        Parameters:
+            xi: Python list or rank-1 array of sites
+            nderiv: int, >= 0, highest derivative order to compute
+            k: None to return all derivative orders 0, ..., nderiv, or an int to return only order k
+            dense: bool, whether to scatter the result into dense rows (one column per basis function)
+
+        Returns:
+            if dense: array of shape (n, nderiv+1, n_basis) (if k is None) or (n, n_basis);
+            otherwise (ders, start) as in `local_derivatives` (ders of shape (n, p+1) if k is given).
+        """
+        x     = self.__sites(xi)
+        n     = x.shape[0]
+        shape = (n,) if k is not None else (n, nderiv + 1)
+        if dense:
+            out = np.zeros( shape + (self.n_basis,), dtype=self.dtype )
+        else:
+            out   = np.empty( shape + (self.p + 1,), dtype=self.dtype )
+            start = np.empty( (n,), dtype=int )
+
+        def evaluate(a, b):
+            ders, s = self.__local(x[a:b], nderiv)
+            if k is not None:
+                ders = ders[:, k]
+            if dense:
+                self.__dense(ders, s, out=out[a:b])
+            else:
+                out[a:b]   = ders
+                start[a:b] = s
+        _parallel_ranges(n, self.workers, evaluate)
+
+        if dense:
+            return out
+        return out, start
+
+    def local_basis(self, xi, deriv_order=0):
+        """Evaluate only the nonzero basis functions (or their derivatives) at the given sites.
+
+        The knot span of each site is located, and only the p+1 basis functions that are nonzero
+        there are computed, at O(p**2) cost per site instead of O(number of knots * p) for the full
+        recursion of scalar `__call__`. Locating the span costs one floor division if the knots are
+        uniform (see `__uniform_tables`); otherwise O(1) amortized per site if the sites are sorted
+        and at least as many as the knots (a linear merge with the knots; the compiled backend
+        tracks the span incrementally for any sorted batch), and O(log(number of knots)) per site
+        by binary search if not.
+
+        Parameters:
+            xi: scalar, or Python list or rank-1 array of sites
+            deriv_order: int, >= 0, order of derivative to compute.
+                         The default is 0, which means the function value itself.
+
+        Returns:
+            (N, start):
+                if `xi` is a scalar, N is a rank-1 array of length p+1 and start is an int;
+                otherwise N has shape (len(xi), p+1) and start is a rank-1 int array.
+
+                N[...,j] is the value of (the `deriv_order`-th derivative of) basis function
+                number ``start + j`` at the site.
+                Entries that refer to nonexistent basis functions (``start + j`` < 0, or >= the
+                number of basis functions; this happens near the ends of a knot vector that does
+                not have repeated endpoints) are zero, as are all entries for sites outside the
+                half-open range [knot_vector[0], knot_vector[-1]).
+        """
+        deriv_order = int(deriv_order)
+        if deriv_order < 0:
+            raise ValueError("deriv_order must be >= 0, got %d" % (deriv_order))
+
+        if np.ndim(xi) == 0:
+            ders, start = self.local_derivatives(xi, deriv_order)
+            return ders[deriv_order], start
+        return self.__batch(xi, deriv_order, k=deriv_order)
+
+    def local_derivatives(self, xi, order):
+        """Evaluate the nonzero basis functions and all their derivatives up to `order`, in one pass.
+
+        Like `local_basis`, but returns all derivative orders 0, 1, ..., `order` at once.
+
+        Parameters:
+            xi: scalar, or Python list or rank-1 array of sites
+            order: int, >= 0, highest derivative order to compute
+
+        Returns:
+            (ders, start):
+                if `xi` is a scalar, ders is a rank-2 array of shape (order+1, p+1) and start is an int;
+                otherwise ders has shape (len(xi), order+1, p+1) and start is a rank-1 int array.
+
+                ders[...,k,j] is the `k`-th derivative of basis function number ``start + j``
+                at the site, with the same conventions for zero entries as in `local_basis`.
+        """
+        order = int(order)
+        if order < 0:
+            raise ValueError("order must be >= 0, got %d" % (order))
+
+        if np.ndim(xi) == 0:
+            ders, start = self.__local( np.atleast_1d(xi), order )
+            return ders[0], int(start[0])
+        return self.__batch(xi, order)
+
+    def local_basis_all_orders(self, xi):
+        """Evaluate the nonzero basis functions of all orders 0, 1, ..., p on this knot vector, in one pass.
+
+        The triangular scheme of `local_basis` computes the basis functions of order p from those of
+        orders 0, ..., p-1 in the same knot span; here all the levels are kept. This replaces p+1
+        separate evaluations with Bspline(knot_vector, q), q = 0, ..., p.
+
+        Parameters:
+            xi: scalar, or Python list or rank-1 array of sites
+
+        Returns:
+            (V, start):
+                if `xi` is a scalar, V is a rank-2 array of shape (p+1, p+1) and start is an int;
+                otherwise V has shape (len(xi), p+1, p+1) and start is a rank-1 int array.
+
+                V[...,q,j] is the value of basis function number ``start + j`` of order q
+                (on the same knot vector) at the site. Only j >= p-q can be nonzero, since the
+                nonzero functions of order q in a knot span are the last q+1 of those of order p.
+                Entries for nonexistent basis functions and for sites outside the half-open range
+                [knot_vector[0], knot_vector[-1]) are zero, as in `local_basis`.
+        """
+        scalar = (np.ndim(xi) == 0)
+        x      = self.__sites(xi)
+        p, t   = self.p, self.knot_vector
+        n      = x.shape[0]
+
+        kernels = self.__kernels()
+        if self.n_basis == 0  or  not (t[-1] > t[0]):
+            V     = np.zeros( (n, p+1, p+1), dtype=self.dtype )
+            start = np.zeros( (n,), dtype=int )
+        elif kernels is not None:
+            V, start = kernels.local_all_orders( self.__padded_knots(), x, p, t[0], t[-1], len(t), _is_sorted(x) )
+        else:
+            V            = np.zeros( (n, p+1, p+1), dtype=self.dtype )
+            tp           = self.__padded_knots()
+            span, inside = self.__find_span(x)
+            x     = np.where(inside, x, t[0])[:, np.newaxis]
+            j     = np.arange(1, p+1)
+            left  = x - tp[span[:, np.newaxis] + 1 - j]
+            right = tp[span[:, np.newaxis] + j] - x
+
+            # as in `__local_general`, storing every level
+            _triangular_values( lambda k: (right[:, :k], left[:, k-1::-1]), n, p, self.dtype, levels=V )
+
+            # order q has len(t) - q - 1 basis functions
+            start = span - 2*p
+            cols  = start[:, np.newaxis, np.newaxis] + np.arange(p+1)
+            nq    = len(t) - np.arange(p+1) - 1
+            bad   = (cols < 0) | (cols >= nq[:, np.newaxis]) | ~inside[:, np.newaxis, np.newaxis]
+            V[bad] = 0.
+
+        if scalar:
+            return V[0], int(start[0])
+        return V, start
+
+    def local_integrals(self, xi):
+        """Evaluate the integrals of the basis functions from knot_vector[0] to the given sites.
+
+        The integral of basis function i is ``w_i * sum_{j > i} E_j(x)``, where
+        ``w_i = (t[i+p+1] - t[i]) / (p+1)`` is its total integral and E is the antiderivative basis
+        (see `antiderivative_basis`). Only the p+2 functions E_j that are nonzero at the site
+        are needed, so the cost is the same as for `local_basis` of order p+1.
+
+        Parameters:
+            xi: scalar, or Python list or rank-1 array of sites
+
+        Returns:
+            (Q, first):
+                if `xi` is a scalar, Q is a rank-1 array of length p+2 and first is an int;
+                otherwise Q has shape (len(xi), p+2) and first is a rank-1 int array.
+
+                Q[...,j] is the integral of basis function number ``first + j`` from
+                knot_vector[0] to the site. All basis functions with index < first are integrated
+                over their whole support (the integral is w_i), and those with index > first + p+1
+                have integral zero. Entries for nonexistent basis functions are zero.
+
+                Sites >= knot_vector[-1] give the total integrals (first = number of basis functions),
+                and sites < knot_vector[0] give zeros (first = 0).
+        """
+        scalar = (np.ndim(xi) == 0)
+        x      = self.__sites(xi)
+        p, t   = self.p, self.knot_vector
+        nbasis = self.n_basis
+
+        N, s = self.antiderivative_basis().local_basis(x)
+        s    = np.asarray(s)
+        k    = p + 2
+
+        # Q[:,m] = sum_{m' >= m} N[:,m'], from the right (all E_j on the right exist; see `antiderivative_basis`)
+        Q = np.dot( N, np.tril( np.ones( (k, k), dtype=N.dtype ) ) )
+
+        # times the integrals of the basis functions; zero-padded for nonexistent ones
+        first = s - 1
+        w     = np.concatenate( (np.zeros( (k,), dtype=self.dtype ), _integral_weights(t, p), np.zeros( (k,), dtype=self.dtype )) )
+        w     = np.lib.stride_tricks.as_strided( w, shape=(w.shape[0] - k + 1, k), strides=(w.strides[0],)*2 )
+        Q    *= w[first + k]  # row i: weights of basis functions first[i], ..., first[i]+p+1
+
+        below = (x < t[0])
+        above = (x >= t[-1])
+        if np.any(below)  or  np.any(above):
+            Q[below | above] = 0.
+            first[below] = 0
+            first[above] = nbasis
+
+        if scalar:
+            return Q[0], int(first[0])
+        return Q, first
+
     @memoize
-    def __call__(self, xi):
-        """Convenience function to make the object callable.  Also 'memoized' for speed."""
+    def __call_scalar(self, xi):
+        """Evaluate the basis functions at a single site. 'Memoized' for speed."""
         return self.__basis(xi, self.p, compute_derivatives=False)
 
     @memoize
-    def d(self, xi):
-        """Convenience function to compute first derivative of basis functions. 'Memoized' for speed."""
+    def __d_scalar(self, xi):
+        """Evaluate the first derivatives of the basis functions at a single site. 'Memoized' for speed."""
+        if self.p == 0:  # piecewise constant; __basis would return the values themselves
+            return np.zeros_like( self.__basis0(xi) )
         return self.__basis(xi, self.p, compute_derivatives=True)
 
+    def __call__(self, xi):
+        """Convenience function to make the object callable.
+
+        Parameters:
+            xi: scalar, or Python list or rank-1 array of sites
+
+        Returns:
+            if `xi` is a scalar, rank-1 array with one element per basis function
+            ('memoized' for speed);
+
+            otherwise rank-2 array of shape (len(xi), number of basis functions),
+            computed in a single batched pass using local support (not memoized;
+            see `local_basis`).
+        """
+        if np.ndim(xi) == 0:
+            return self.__call_scalar( self.dtype.type(xi) )
+        return self.__batch(xi, 0, k=0, dense=True)
+
+    def d(self, xi):
+        """Convenience function to compute first derivative of basis functions.
+
+        Accepts a scalar or a rank-1 array of sites, with the same output conventions as `__call__`.
+        Scalar evaluation is 'memoized' for speed.
+        """
+        if np.ndim(xi) == 0:
+            return self.__d_scalar( self.dtype.type(xi) )
+        return self.__batch(xi, 1, k=1, dense=True)
+
     def plot(self):
         """Plot basis functions over full range of knots.
 
@@ -150,7 +1221,7 @@ class Bspline():
 
         x = np.linspace(x_min, x_max, num=1000)
 
-        N = np.array([self(i) for i in x]).T
+        N = self(x).T
 
         for n in N:
             plt.plot(x,n)
@@ -175,7 +1246,7 @@ class Bspline():
 
         x = np.linspace(x_min, x_max, num=1000)
 
-        N = np.array([self.d(i) for i in x]).T
+        N = self.d(x).T
 
         for n in N:
             plt.plot(x,n)
@@ -183,43 +1254,39 @@ class Bspline():
         return plt.show()
 
 
-    def __diff_internal(self):
-        """Differentiate a B-spline once, and return the resulting coefficients and Bspline objects.
+    @memoize
+    def __derivatives_scalar(self, xi, order):
+        """Evaluate all derivatives up to `order` at a single site. 'Memoized' for speed."""
+        ders, start = self.__local( np.atleast_1d(xi), order )
+        return self.__dense( ders, start )[0]
 
-This preserves the Bspline object nature of the data, enabling recursive implementation
-of higher-order differentiation (see `diff`).
+    def derivatives(self, xi, order):
+        """Evaluate the basis functions and all their derivatives up to `order`, in one pass.
 
-The value of the first derivative of `B` at a point `x` can be obtained as::
+All derivatives are obtained from the same triangular table of the local-support
+Cox - de Boor recursion (see `local_basis`), at O(p**2 + order*p**2) cost per site.
 
-    def diff1(B, x):
-        terms = B.__diff_internal()
-        return sum( ci*Bi(x) for ci,Bi in terms )
+Parameters:
+    xi:
+        scalar, or Python list or rank-1 array of sites
+    order:
+        int, >= 0, highest derivative order to compute
 
 Returns:
-    tuple of tuples, where each item is (coefficient, Bspline object).
-
-See:
-    `diff`: differentiation of any order >= 0
-"""
-        assert self.p > 0, "order of Bspline must be > 0"  # we already handle the other case in diff()
-
-        # https://www.cs.mtu.edu/~shene/COURSES/cs3621/NOTES/spline/B-spline/bspline-derv.html
-        #
-        t    = self.knot_vector
-        p    = self.p
-        Bi   = Bspline( t[:-1], p-1 )
-        Bip1 = Bspline( t[1:],  p-1 )
+    if `xi` is a scalar, rank-2 array D of shape (order+1, number of basis functions)
+    ('memoized' for speed);
 
-        numer1 = +p
-        numer2 = -p
-        denom1 = t[p:-1]   - t[:-(p+1)]
-        denom2 = t[(p+1):] - t[1:-p]
+    otherwise rank-3 array D of shape (len(xi), order+1, number of basis functions),
 
-        with np.errstate(divide='ignore', invalid='ignore'):
-            ci   = np.where(denom1 != 0., (numer1 / denom1), 0.)
-            cip1 = np.where(denom2 != 0., (numer2 / denom2), 0.)
+    such that D[...,k,j] = D**k B_j(xi). Derivatives of order > p are zero.
+"""
+        order = int(order)
+        if order < 0:
+            raise ValueError("order must be >= 0, got %d" % (order))
 
-        return ( (ci,Bi), (cip1,Bip1) )
+        if np.ndim(xi) == 0:
+            return self.__derivatives_scalar( self.dtype.type(xi), order )
+        return self.__batch(xi, order, dense=True)
 
 
     def diff(self, order=1):
@@ -231,7 +1298,11 @@ Parameters:
 
 Returns:
     **lambda** `x`: ... that evaluates the `order`-th derivative of `B` at the point `x`.
-                    The returned function internally uses __call__, which is 'memoized' for speed.
+                    The returned function internally uses `derivatives` (or, for order 0, `__call__`),
+                    which is 'memoized' for speed.
+
+                    `x` may also be a rank-1 array of sites, in which case the result is a rank-2 array
+                    of shape (len(x), number of basis functions), computed in a single batched pass.
 """
         order = int(order)
         if order < 0:
@@ -240,29 +1311,34 @@ Returns:
         if order == 0:
             return self.__call__
 
-        if order > self.p:   # identically zero, but force the same output format as in the general case
-            dummy = self.__call__(0.)  # get number of basis functions and output dtype
-            nbasis = dummy.shape[0]
-            return lambda x: np.zeros( (nbasis,), dtype=dummy.dtype )  # accept but ignore input x
+        # derivatives of order > p come out as zeros, in the same output format as in the general case
+        def f(x):
+            if np.ndim(x) == 0:
+                return self.derivatives(x, order)[order]
+            return self.__batch(x, order, k=order, dense=True)
+        return f
 
-        # At each differentiation, each term maps into two new terms.
-        # The number of terms in the result will be 2**order.
-        #
-        # This will cause an exponential explosion in the number of terms for high derivative orders,
-        # but for the first few orders (practical usage; >3 is rarely needed) the approach works.
-        #
-        terms = [ (1.,self) ]
-        for k in range(order):
-            tmp = []
-            for Ci,Bi in terms:
-                tmp.extend( (Ci*cn, Bn) for cn,Bn in Bi.__diff_internal() )  # NOTE: also propagate Ci
-            terms = tmp
-
-        # perform final summation at call time
-        return lambda x: sum( ci*Bi(x) for ci,Bi in terms )
 
+    def __with_dtype(self, dtype):
+        """Return a Bspline with the same knots, order and `workers` that computes in `dtype` (for internal use).
 
-    def collmat(self, tau, deriv_order=0):
+        This instance itself if `dtype` is None or already its dtype; otherwise a basis created
+        on first use for each dtype, then cached.
+        """
+        if dtype is None  or  np.dtype(dtype) == self.dtype:
+            return self
+        dtype = np.dtype(dtype)
+        try:
+            siblings = self.__siblings
+        except AttributeError:
+            siblings = self.__siblings = {}
+        B = siblings.get(dtype)
+        if B is None:
+            B = siblings[dtype] = Bspline( self.knot_vector, self.p, cache_size=0, dtype=dtype )
+        B.workers = self.workers
+        return B
+
+    def collmat(self, tau, deriv_order=0, sparse=False, dtype=None):
         """Compute collocation matrix.
 
 Parameters:
@@ -271,6 +1347,14 @@ Parameters:
     deriv_order:
         int, >=0, order of derivative for which to compute the collocation matrix.
         The default is 0, which means the function value itself.
+    sparse:
+        bool. If True, return the matrix in compressed sparse row (CSR) format,
+        built directly from the local support of the basis (see `local_basis`)
+        without forming the dense matrix. Each row has at most p+1 nonzeros.
+    dtype:
+        None, or a NumPy floating-point dtype in which to evaluate the basis and allocate
+        the matrix (e.g. np.float32 to halve the memory traffic). The default None uses
+        the `dtype` of this basis. See `Bspline` for the accuracy of float32.
 
 Returns:
     A:
@@ -282,6 +1366,10 @@ Returns:
         if len(tau) == 1, rank-1 array such that
             A[j]   = D**deriv_order B_j(tau)
 
+        if sparse=True, scipy.sparse.csr_matrix of shape (len(tau), number of basis functions)
+        (never squeezed). If SciPy is not installed, the tuple (data, indices, indptr, shape)
+        of CSR arrays is returned instead.
+
 Example:
     If the coefficients of a spline function are given in the vector c, then::
 
@@ -293,17 +1381,535 @@ Example:
     Similarly for derivatives (if the supplied `deriv_order`> 0).
 
 """
-        # get number of basis functions and output dtype
-        dummy = self.__call__(0.)
-        nbasis = dummy.shape[0]
-
         tau = np.atleast_1d(tau)
         if tau.ndim > 1:
             raise ValueError("tau must be a list or a rank-1 array")
 
-        A = np.empty( (tau.shape[0], nbasis), dtype=dummy.dtype )
+        B = self.__with_dtype(dtype)
+        if B is not self:
+            return B.collmat(tau, deriv_order=deriv_order, sparse=sparse)
+
+        if sparse:
+            N, start = self.local_basis(tau, deriv_order)
+            return _local_to_csr(N, start[:, np.newaxis] + np.arange(self.p + 1), self.n_basis)
+
         f = self.diff(order=deriv_order)
-        for i,taui in enumerate(tau):
-            A[i,:] = f(taui)
+        A = f(tau)  # batched evaluation over all sites at once
 
         return np.squeeze(A)
+
+
+    def collmat_chunks(self, tau, chunksize=65536, deriv_order=0, sparse=False, dtype=None):
+        """Compute the collocation matrix in blocks of rows, with memory bounded by the chunk size.
+
+Parameters:
+    tau:
+        collocation sites: a Python list or rank-1 array (including a memory-mapped array,
+        e.g. from ``np.load(filename, mmap_mode='r')``, which is read one chunk at a time),
+        or an iterator yielding consecutive rank-1 arrays of sites
+    chunksize:
+        int, maximum number of sites (rows) per block
+    deriv_order, sparse, dtype:
+        as in `collmat`
+
+Returns:
+    generator, yielding the consecutive row blocks of the collocation matrix, each a rank-2
+    array (never squeezed) or sparse matrix of shape (number of sites in chunk, n_basis).
+
+See also:
+    `bspline.bspline.NormalEquations.add_chunks`, to accumulate a least-squares fit
+    from chunks of data without keeping the blocks.
+"""
+        B = self.__with_dtype(dtype)
+        for chunk in _chunks(tau, chunksize):
+            if sparse:
+                yield B.collmat(chunk, deriv_order=deriv_order, sparse=True)
+            else:
+                yield B.diff(order=deriv_order)(chunk)
+
+
+    def gram(self, deriv_order=0, banded=True):
+        """Compute the Gram matrix of the basis functions (or of their derivatives).
+
+        G[i,j] = integral of D**r B_i * D**r B_j  over [knot_vector[0], knot_vector[-1]],  r = `deriv_order`.
+
+        For r = 0 this is the mass matrix, and for r = 2 the usual roughness penalty of smoothing
+        splines and P-splines. The integrals are computed exactly (up to rounding) by Gauss - Legendre
+        quadrature with p-r+1 nodes per knot interval, and the matrix is accumulated directly in banded
+        form from the local basis values at the nodes, at O(number of knots * p**3) cost.
+
+        Parameters:
+            deriv_order: int, >= 0, order of derivative r
+            banded: bool. If True, return the upper band in the storage format of
+                    `scipy.linalg.solveh_banded` (see `NormalEquations`); if False, the dense matrix.
+
+        Returns:
+            if banded, rank-2 array ab of shape (p+1, number of basis functions), such that
+            ``ab[p + i - j, j] = G[i,j]`` for j-p <= i <= j; otherwise G itself, of shape
+            (number of basis functions, number of basis functions).
+        """
+        deriv_order = int(deriv_order)
+        if deriv_order < 0:
+            raise ValueError("deriv_order must be >= 0, got %d" % (deriv_order))
+
+        p      = self.p
+        nbasis = self.n_basis
+        u      = np.unique(self.knot_vector)
+
+        # Gauss - Legendre nodes and weights, mapped to each knot interval;
+        # the integrand is a polynomial of degree 2*(p-r) there
+        xg, wg = np.polynomial.legendre.leggauss( max(p - deriv_order + 1, 1) )
+        mid    = (u[1:] + u[:-1]) / 2.
+        half   = (u[1:] - u[:-1]) / 2.
+        x      = (mid[:, np.newaxis] + half[:, np.newaxis] * xg).ravel()
+        w      = (half[:, np.newaxis] * wg).ravel().astype(self.dtype, copy=False)
+
+        N, start = self.local_basis(x, deriv_order)
+        ab       = _banded_gram( N, start, nbasis, w )
+        if banded:
+            return ab
+        return _banded_to_dense(ab)
+
+    def antiderivative_basis(self):
+        """Return the basis for the antiderivatives of the splines in this basis.
+
+        This is the Bspline of order p+1 on the knot vector with one more copy of the left endpoint
+        and p+1 more copies of the right endpoint, so that it has p+1 more basis functions than this
+        basis. The extra functions on the right keep ``sum_{j > i} E_j`` (and hence the integrals of
+        `local_integrals`) exact up to knot_vector[-1] also when the right endpoint is not repeated.
+        Created on first use, then cached.
+
+        See also:
+            `local_integrals`, `integral_collmat`, `Spline.antiderivative`.
+        """
+        try:
+            return self.__antiderivative
+        except AttributeError:
+            t = self.knot_vector
+            E = self.__antiderivative = Bspline( np.concatenate( (t[:1], t, np.repeat(t[-1:], self.p + 1)) ), self.p + 1,
+                                                 cache_size=memoize.get_cache(self).maxsize, workers=self.workers,
+                                                 dtype=self.dtype )
+            return E
+
+    def integral_collmat(self, tau):
+        """Compute the integral collocation matrix.
+
+Parameters:
+    tau:
+        scalar, or Python list or rank-1 array, sites
+
+Returns:
+    A:
+        rank-2 array of shape (len(tau), number of basis functions) such that
+
+            A[i,j] = integral of B_j from knot_vector[0] to tau[i]
+
+        (rank-1 array if `tau` is a scalar). See `local_integrals`.
+
+Example:
+    If the coefficients of a spline function are given in the vector c, then
+    ``A.dot(c)`` are the integrals of the spline from knot_vector[0] to the sites.
+"""
+        Q, first = self.local_integrals(tau)
+        scalar   = (np.ndim(first) == 0)
+        Q        = np.atleast_2d(Q)
+        first    = np.atleast_1d(first)
+
+        nbasis = self.n_basis
+        A      = np.where( np.arange(nbasis) < first[:, np.newaxis], _integral_weights(self.knot_vector, self.p), 0. )
+        cols   = first[:, np.newaxis] + np.arange(self.p + 2)
+        valid  = (cols >= 0) & (cols < nbasis)
+        rows, j = np.nonzero(valid)
+        A[rows, cols[valid]] = Q[rows, j]
+
+        if scalar:
+            return A[0]
+        return A
+
+    def insert_knots(self, knots):
+        """Insert knots into the knot vector, by the Oslo algorithm.
+
+        Every spline in the span of this basis is also in the span of the refined basis.
+        The returned matrix maps coefficients in this basis to coefficients in the refined basis.
+        Each of its rows has at most p+1 nonzeros, which are computed by the triangular scheme of
+        `local_basis` with the knots ``t_new[j+1], ..., t_new[j+p]`` in place of the site,
+        at O(p**2) cost per new basis function.
+
+        Parameters:
+            knots: scalar, or Python list or rank-1 array of knots to insert (in any order;
+                   repeated entries raise the multiplicity accordingly). All knots must lie
+                   in [knot_vector[0], knot_vector[-1]].
+
+        Returns:
+            (B, T):
+                B is the refined Bspline (same order, `cache_size`, `workers` and `dtype` as this one),
+
+                T is a scipy.sparse.csr_matrix of shape (B.n_basis, self.n_basis) such that
+                ``T.dot(c)`` are the coefficients in B of the spline with coefficients c in this basis
+                (the tuple (data, indices, indptr, shape) of CSR arrays if SciPy is not installed).
+
+        See also:
+            `refine`, `Spline.insert_knots`.
+        """
+        x = np.atleast_1d(knots)
+        if x.ndim > 1:
+            raise ValueError("knots must be a scalar, Python list or rank-1 array, but got rank = %d" % (x.ndim))
+
+        p, t = self.p, self.knot_vector
+        if self.n_basis == 0  or  not (t[-1] > t[0]):
+            raise ValueError("cannot insert knots into a knot vector without nonzero-length spans")
+        if np.any( (x < t[0]) | (x > t[-1]) ):
+            raise ValueError("knots to insert must lie in [%g, %g]" % (t[0], t[-1]))
+
+        tnew = np.sort( np.concatenate( (t, x) ) )
+        B    = Bspline( tnew, p, cache_size=memoize.get_cache(self).maxsize, workers=self.workers, dtype=self.dtype )
+        n    = B.n_basis
+
+        # Old knot span containing the first knot of each new basis function.
+        # New basis functions starting at the right end of the range vanish identically.
+        tp     = self.__padded_knots()
+        tj     = tnew[:n]
+        inside = tj < t[-1]
+        span   = np.searchsorted( tp, np.where(inside, tj, t[0]), side='right' ) - 1
+
+        # Triangular scheme as in `__local`, with the site replaced by tnew[j+k] at level k.
+        def diffs(k):
+            xk = tnew[k:k+n, np.newaxis]
+            jj = np.arange(1, k+1)
+            return (tp[span[:, np.newaxis] + jj] - xk,            # right_{r+1},  r = 0, ..., k-1
+                    xk - tp[span[:, np.newaxis] + 1 - jj[::-1]])  # left_{k-r}
+        alpha = _triangular_values( diffs, n, p, self.dtype )
+
+        cols = (span - 2*p)[:, np.newaxis] + np.arange(p+1)
+        alpha[~inside] = 0.
+        return B, _local_to_csr( alpha, cols, self.n_basis )
+
+    def refine(self, divisions=2):
+        """Subdivide each nonzero-length knot span into `divisions` equal parts.
+
+        Parameters:
+            divisions: int, >= 1, number of parts per knot span
+
+        Returns:
+            (B, T) as in `insert_knots`.
+        """
+        divisions = int(divisions)
+        if divisions < 1:
+            raise ValueError("divisions must be >= 1, got %d" % (divisions))
+
+        u = np.unique(self.knot_vector)
+        s = np.arange(1, divisions) / divisions
+        return self.insert_knots( (u[:-1, np.newaxis] + np.diff(u)[:, np.newaxis] * s).ravel() )
+
+
+class Spline(object):
+    """A spline function: a Bspline basis together with a set of coefficients.
+
+    The spline is evaluated from the p+1 nonzero basis functions at each site (see
+    `Bspline.local_basis`), which is equivalent to de Boor's algorithm. The collocation
+    matrix is never formed, so the cost is O(p**2) per site regardless of the number of
+    basis functions.
+    """
+
+    def __init__(self, basis, coeffs):
+        """Create a Spline object.
+
+        Parameters:
+            basis: Bspline object
+            coeffs: rank-1 array of length nbasis (scalar-valued spline), or rank-2 array of shape
+                    (nbasis, m) (m-valued spline, e.g. a curve in R**m, or m independent signals
+                    sharing the basis, which is then evaluated only once per site), where nbasis
+                    is the number of basis functions of `basis`.
+
+        Returns:
+            Spline object, callable to evaluate the spline at given values of `x`.
+        """
+        coeffs = np.asanyarray(coeffs)
+        if coeffs.ndim not in (1, 2):
+            raise ValueError("coeffs must be a rank-1 or rank-2 array, but got rank = %d" % (coeffs.ndim))
+
+        nbasis = basis.n_basis
+        if coeffs.shape[0] != nbasis:
+            raise ValueError("coeffs must have one row per basis function (%d), but got %d" % (nbasis, coeffs.shape[0]))
+
+        self.basis  = basis
+        self.coeffs = coeffs
+
+        # Coefficients as a rank-2 array, padded with p zero rows at each end,
+        # so that every index start+j returned by Bspline.local_basis is valid after shifting by p.
+        p  = basis.p
+        c2 = coeffs.reshape( (nbasis, -1) )
+        self.__cpad = np.concatenate( (np.zeros( (p,) + c2.shape[1:], dtype=c2.dtype ),
+                                       c2,
+                                       np.zeros( (p,) + c2.shape[1:], dtype=c2.dtype )) )
+
+    def derivatives(self, x, order):
+        """Evaluate the spline and all its derivatives up to `order`, in one pass.
+
+        Parameters:
+            x: scalar, or Python list or rank-1 array of sites
+            order: int, >= 0, highest derivative order to compute
+
+        Returns:
+            array D such that D[...,k] (scalar-valued spline) or D[...,k,:] (m-valued spline)
+            is the `k`-th derivative at `x`. If `x` is an array, the first axis of D indexes the sites.
+        """
+        ders, start = self.basis.local_derivatives(x, order)
+        B = self.basis
+        p = B.p
+        m = self.__cpad.shape[1]
+
+        if m > p+1  and  np.ndim(start) > 0  and  self.__have_scipy():
+            # many coefficient columns (e.g. many signals on one basis): one sparse product
+            # per derivative order, which streams the coefficient rows instead of gathering
+            # p+1 of them for every site
+            c2   = self.__cpad[p:p+B.n_basis]
+            cols = start[:, np.newaxis] + np.arange(p+1)
+            out  = np.empty( (len(start), order+1, m), dtype=np.result_type(ders, c2) )
+            for k in range(order+1):
+                out[:, k] = _local_to_csr( ders[:, k], cols, B.n_basis ).dot(c2)
+        else:
+            idx = np.asarray(start)[..., np.newaxis] + p + np.arange(p+1)
+            out = np.einsum( '...kj,...jm->...km', ders, self.__cpad[idx] )
+        if self.coeffs.ndim == 1:
+            out = out[..., 0]
+        return out
+
+    @staticmethod
+    def __have_scipy():
+        """Return whether scipy.sparse is available (for internal use)."""
+        try:
+            importlib.import_module("scipy.sparse")
+        except ImportError:
+            return False
+        return True
+
+    def __call__(self, x):
+        """Evaluate the spline at `x` (scalar, or Python list or rank-1 array of sites).
+
+        Returns a scalar or rank-1 array of length m (for a single site), or an array
+        of shape (len(x),) or (len(x), m) (for an array of sites).
+        """
+        return self.diff(order=0)(x)
+
+    def d(self, x):
+        """Evaluate the first derivative of the spline at `x`. See `__call__`."""
+        return self.diff(order=1)(x)
+
+    def diff(self, order=1):
+        """Differentiate the spline `order` number of times.
+
+Parameters:
+    order:
+        int, >= 0
+
+Returns:
+    **lambda** `x`: ... that evaluates the `order`-th derivative of the spline at `x`,
+                    with the same output conventions as `__call__`.
+"""
+        order = int(order)
+        if order < 0:
+            raise ValueError("order must be >= 0, got %d" % (order))
+
+        if self.coeffs.ndim == 1:
+            return lambda x: self.derivatives(x, order)[..., order]
+        return lambda x: self.derivatives(x, order)[..., order, :]
+
+    def insert_knots(self, knots):
+        """Return the same spline, represented in the basis with `knots` inserted.
+
+        The coefficients are mapped by the sparse matrix of `Bspline.insert_knots`,
+        at O(p) cost per coefficient; no refit is needed.
+        """
+        B, T = self.basis.insert_knots(knots)
+        return Spline( B, _csr_dot(T, self.coeffs) )
+
+    def refine(self, divisions=2):
+        """Return the same spline, with each knot span subdivided. See `Bspline.refine`."""
+        B, T = self.basis.refine(divisions)
+        return Spline( B, _csr_dot(T, self.coeffs) )
+
+    def antiderivative(self):
+        """Return the antiderivative of the spline that vanishes at the left end of the knot vector.
+
+        The result is a Spline in `Bspline.antiderivative_basis`. Its coefficients are the cumulative
+        sums of the coefficients times the integrals of the basis functions (then the total integral
+        for the p extra basis functions on the right), so nothing is evaluated.
+        """
+        B  = self.basis
+        cw = np.cumsum( self.coeffs * _integral_weights(B.knot_vector, B.p).reshape( (-1,) + (1,)*(self.coeffs.ndim - 1) ), axis=0 )
+        return Spline( B.antiderivative_basis(), np.concatenate( (np.zeros_like(cw[:1]), cw, np.repeat(cw[-1:], B.p, axis=0)) ) )
+
+    def integrate(self, a, b):
+        """Compute definite integrals of the spline over many intervals at once.
+
+        Each endpoint costs O(p**2) (one local evaluation of order p+1; see `Bspline.local_integrals`),
+        independently of the length of the interval.
+
+        Parameters:
+            a, b: scalars or arrays (broadcast against each other), lower and upper limits.
+                  The spline is zero outside [knot_vector[0], knot_vector[-1]].
+
+        Returns:
+            array of the broadcast shape of `a` and `b` (with an extra last axis of length m for an
+            m-valued spline), the integrals from a to b.
+        """
+        a, b  = np.broadcast_arrays( np.asarray(a), np.asarray(b) )
+        shape = a.shape
+        F     = self.__integral( np.concatenate( (a.ravel(), b.ravel()) ) )
+        n     = a.size
+        out   = F[n:] - F[:n]
+        return out.reshape( shape + out.shape[1:] )
+
+    def __integral(self, x):
+        """Evaluate the antiderivative of `integrate` at a rank-1 array of sites (for internal use)."""
+        B        = self.basis
+        p        = B.p
+        Q, first = B.local_integrals(x)
+
+        # basis functions below `first` contribute their whole integral
+        c2 = self.coeffs.reshape( (B.n_basis, -1) )
+        cw = np.concatenate( (np.zeros( (1, c2.shape[1]) ),
+                              np.cumsum( c2 * _integral_weights(B.knot_vector, p)[:, np.newaxis], axis=0 )) )
+
+        # the next p+2 contribute the local integrals; windows of zero-padded coefficients
+        k  = p + 2
+        cp = np.concatenate( (np.zeros( (k, c2.shape[1]) ), c2, np.zeros( (k, c2.shape[1]) )) )
+        cp = np.lib.stride_tricks.as_strided( cp, shape=(cp.shape[0] - k + 1, k, cp.shape[1]),
+                                              strides=(cp.strides[0],) + cp.strides )
+        F  = cw[np.maximum(first, 0)] + np.einsum( 'ij,ijm->im', Q, cp[first + k] )
+        if self.coeffs.ndim == 1:
+            F = F[:, 0]
+        return F
+
+
+class TensorBspline(object):
+    """Tensor-product B-spline basis in d dimensions.
+
+    Basis function number (i_1, ..., i_d) is the product B_{i_1}(x_1) * ... * B_{i_d}(x_d)
+    of the one-dimensional bases along each axis. Basis functions are numbered in C (row-major)
+    order, so that a coefficient array of shape `shape` matches ``c.ravel()``.
+
+    Evaluation uses the local support along each axis (see `Bspline.local_basis`); each point
+    has at most (p_1+1) * ... * (p_d+1) nonzero basis functions.
+    """
+
+    def __init__(self, knot_vectors, orders):
+        """Create a TensorBspline object.
+
+        Parameters:
+            knot_vectors: sequence of d knot vectors (Python lists or rank-1 arrays), one per axis
+            orders: int (same order along all axes), or sequence of d ints
+
+        Returns:
+            TensorBspline object. The attributes `shape` (number of basis functions along each
+            axis) and `n_basis` (total number of basis functions) are available.
+        """
+        knot_vectors = list(knot_vectors)
+        if len(knot_vectors) == 0:
+            raise ValueError("need at least one knot vector")
+        d = len(knot_vectors)
+
+        if np.ndim(orders) == 0:
+            orders = [orders] * d
+        orders = list(orders)
+        if len(orders) != d:
+            raise ValueError("need one order per knot vector (%d), but got %d" % (d, len(orders)))
+
+        self.bases   = [ Bspline(kv, p) for kv,p in zip(knot_vectors, orders) ]
+        self.ndim    = d
+        self.shape   = tuple( B.n_basis for B in self.bases )
+        self.n_basis = int( np.prod(self.shape) )
+        self.dtype   = np.result_type( *[B.dtype for B in self.bases] )
+
+    def __points(self, points):
+        """Convert the input to a rank-2 array of shape (npoints, d) (for internal use)."""
+        points = np.asanyarray(points)
+        if points.ndim == 1  and  points.shape[0] == self.ndim:
+            points = points[np.newaxis, :]
+        if points.ndim != 2  or  points.shape[1] != self.ndim:
+            raise ValueError("points must be a rank-2 array of shape (npoints, %d), but got shape %s" % (self.ndim, points.shape))
+        return points
+
+    def __deriv_orders(self, deriv_orders):
+        """Validate the per-axis derivative orders (for internal use)."""
+        if deriv_orders is None:
+            return [0] * self.ndim
+        deriv_orders = list(deriv_orders)
+        if len(deriv_orders) != self.ndim:
+            raise ValueError("need one derivative order per axis (%d), but got %d" % (self.ndim, len(deriv_orders)))
+        return deriv_orders
+
+    def local_basis(self, points, deriv_orders=None):
+        """Evaluate only the nonzero tensor-product basis functions at the given points.
+
+        Parameters:
+            points: rank-2 array of shape (npoints, d), or a single point as a rank-1 array of length d
+            deriv_orders: sequence of d ints >= 0, order of partial derivative along each axis.
+                          The default None means the function values themselves.
+
+        Returns:
+            (N, cols), rank-2 arrays of shape (npoints, K), where K = (p_1+1) * ... * (p_d+1)
+            (rank-1 arrays of length K for a single point).
+
+            N[i,j] is the value of (the partial derivative of) basis function number cols[i,j]
+            at points[i]. Columns that refer to nonexistent basis functions are -1, with value zero.
+        """
+        single = (np.ndim(points) == 1)
+        points = self.__points(points)
+        deriv_orders = self.__deriv_orders(deriv_orders)
+        n = points.shape[0]
+
+        # Kronecker structure: combine the axes one at a time
+        vals  = np.ones( (n, 1) )
+        cols  = np.zeros( (n, 1), dtype=int )
+        valid = np.ones( (n, 1), dtype=bool )
+        for a,B in enumerate(self.bases):
+            Na, start = B.local_basis(points[:, a], deriv_orders[a])
+            ia = start[:, np.newaxis] + np.arange(B.p + 1)
+            w  = vals.shape[1] * (B.p + 1)  # explicit, so that n = 0 points also work
+            vals  = (vals[:, :, np.newaxis]  * Na[:, np.newaxis, :]).reshape( (n, w) )
+            cols  = (cols[:, :, np.newaxis]  * B.n_basis + ia[:, np.newaxis, :]).reshape( (n, w) )
+            valid = (valid[:, :, np.newaxis] & ((ia >= 0) & (ia < B.n_basis))[:, np.newaxis, :]).reshape( (n, w) )
+        cols[~valid] = -1
+
+        if single:
+            return vals[0], cols[0]
+        return vals, cols
+
+    def collmat(self, points, deriv_orders=None, sparse=False):
+        """Compute collocation matrix.
+
+Parameters:
+    points:
+        rank-2 array of shape (npoints, d), collocation sites
+    deriv_orders:
+        sequence of d ints >= 0, order of partial derivative along each axis.
+        The default None means the function value itself.
+    sparse:
+        bool. If True, return the matrix in compressed sparse row (CSR) format
+        without forming the dense matrix (see `Bspline.collmat`).
+
+Returns:
+    A:
+        rank-2 array (or scipy.sparse.csr_matrix, or CSR arrays if SciPy is not installed)
+        of shape (npoints, n_basis), such that
+
+            A[i,j] = D**deriv_orders B_j(points[i])
+
+Example:
+    If the coefficients of a tensor-product spline are given in an array c of shape `shape`, then::
+
+        A.dot( c.ravel() )
+
+    will give a rank-1 array of function values at the points.
+"""
+        points = self.__points(points)
+        N, cols = self.local_basis(points, deriv_orders)
+        if sparse:
+            return _local_to_csr(N, cols, self.n_basis)
+
+        A = np.zeros( (points.shape[0], self.n_basis), dtype=N.dtype )
+        rows, j = np.nonzero(cols >= 0)
+        A[rows, cols[rows, j]] = N[rows, j]
+        return A
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Opt-in instrumentation of bspline: call counters and timers for the public entry points.
+
+Usage:
+    import bspline.profiling
+
+    with bspline.profiling.profile() as stats:
+        ...  # use bspline
+    print( stats.as_dict() )
+
+or, for long-running processes, ``enable()`` once and scrape ``snapshot()`` periodically.
+
+While enabled, the entry points listed in `ENTRY_POINTS` are replaced by wrappers that count calls
+and accumulate wall-clock time (inclusive of nested instrumented calls; e.g. the time of
+`Bspline.collmat` includes that of the `Bspline.diff` it calls). Additionally counted are:
+
+    "Bspline.__basis"   one level of the full Cox - de Boor recursion (scalar evaluation)
+    "Bspline.__local"   one pass of the local-support engine (batched evaluation; per thread chunk)
+    "memoize.hits", "memoize.misses"   lookups in the memoization caches of all Bspline instances
+
+Disabling restores the original functions, so instrumentation costs nothing when it is off.
+
+Caveats:
+    - Functions imported by name before enabling (``from bspline.splinelab import spcol``)
+      are not instrumented; access them as module attributes instead (``splinelab.spcol``).
+    - Callables returned before enabling (e.g. by `Bspline.diff`) are not instrumented
+      themselves, but the entry points they call are.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+from contextlib import contextmanager
+import functools
+import threading
+import timeit
+
+import bspline.bspline
+import bspline.splinelab
+
+__all__ = ["ENTRY_POINTS", "Registry", "registry", "enable", "disable", "is_enabled", "reset", "snapshot", "profile"]
+
+
+# (owner, attribute name, metric name) of the instrumented entry points; owners are looked up lazily
+ENTRY_POINTS = [ ("Bspline", name, "Bspline.%s" % (name))
+                 for name in ("__init__", "__call__", "d", "diff", "derivatives", "local_basis",
+                              "local_derivatives", "collmat", "collmat_chunks", "insert_knots", "refine",
+                              "local_integrals", "integral_collmat", "antiderivative_basis", "gram",
+                              "local_basis_all_orders") ]
+ENTRY_POINTS += [ ("Bspline", "_Bspline__basis", "Bspline.__basis"),
+                  ("Bspline", "_Bspline__local", "Bspline.__local") ]
+ENTRY_POINTS += [ ("Spline", name, "Spline.%s" % (name))
+                  for name in ("__init__", "derivatives", "__call__", "d", "diff", "insert_knots", "refine",
+                               "antiderivative", "integrate") ]
+ENTRY_POINTS += [ ("TensorBspline", name, "TensorBspline.%s" % (name))
+                  for name in ("__init__", "local_basis", "collmat") ]
+ENTRY_POINTS += [ ("NormalEquations", name, "NormalEquations.%s" % (name))
+                  for name in ("add", "add_local", "add_chunks", "solve") ]
+ENTRY_POINTS += [ ("splinelab", name, "splinelab.%s" % (name))
+                  for name in ("augknt", "aveknt", "aptknt", "knt2mlt", "spcol", "spapi", "spap2",
+                               "sp2pp", "ppval", "pp2sp", "fn2fm") ]
+
+
+class Registry(object):
+    """Thread-safe storage of the collected metrics.
+
+       timers: dict, metric name -> [number of calls, total seconds]
+       counters: dict, metric name -> count
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Zero all metrics."""
+        with self.lock:
+            self.timers   = {}
+            self.counters = {}
+
+    def add_time(self, name, seconds):
+        """Record one call of `name` that took `seconds`."""
+        with self.lock:
+            t = self.timers.setdefault(name, [0, 0.])
+            t[0] += 1
+            t[1] += seconds
+
+    def count(self, name, n=1):
+        """Add `n` to the counter `name`."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        """Return a copy of the metrics as plain dicts (e.g. for JSON export).
+
+        Returns:
+            {"timers": {name: {"calls": int, "seconds": float}}, "counters": {name: int}}
+        """
+        with self.lock:
+            return { "timers"   : dict( (k, {"calls" : v[0], "seconds" : v[1]}) for k,v in self.timers.items() ),
+                     "counters" : dict( self.counters ) }
+
+
+# the global registry, and the original functions while instrumentation is enabled
+registry   = Registry()
+_originals = None
+_clock     = timeit.default_timer
+
+
+def _owner(name):
+    """Return the class or module named in ENTRY_POINTS (for internal use)."""
+    if name == "splinelab":
+        return bspline.splinelab
+    return getattr(bspline.bspline, name)
+
+
+def _timed(func, name):
+    """Wrap `func` to record its calls and run time under `name` (for internal use)."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        t0 = _clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            registry.add_time(name, _clock() - t0)
+    return wrapper
+
+
+def _counted_lookup(lookup):
+    """Wrap `LRUCache.lookup` to count cache hits and misses (for internal use)."""
+    @functools.wraps(lookup)
+    def wrapper(self, key, compute):
+        misses = self.misses
+        res    = lookup(self, key, compute)
+        registry.count( "memoize.misses" if self.misses != misses else "memoize.hits" )
+        return res
+    return wrapper
+
+
+def enable():
+    """Start collecting metrics into `registry`. Does nothing if already enabled."""
+    global _originals
+    if _originals is not None:
+        return
+
+    originals = []
+    for owner_name, attr, name in ENTRY_POINTS:
+        owner = _owner(owner_name)
+        func  = owner.__dict__[attr]
+        originals.append( (owner, attr, func) )
+        setattr( owner, attr, _timed(func, name) )
+
+    cache = bspline.bspline.LRUCache
+    originals.append( (cache, "lookup", cache.__dict__["lookup"]) )
+    cache.lookup = _counted_lookup( cache.__dict__["lookup"] )
+
+    _originals = originals
+
+def disable():
+    """Stop collecting metrics, and restore the original functions. The collected metrics are kept."""
+    global _originals
+    if _originals is None:
+        return
+    for owner, attr, func in reversed(_originals):
+        setattr(owner, attr, func)
+    _originals = None
+
+def is_enabled():
+    """Return whether instrumentation is currently enabled."""
+    return _originals is not None
+
+def reset():
+    """Zero all collected metrics."""
+    registry.reset()
+
+def snapshot():
+    """Return the collected metrics as a dict. See `Registry.as_dict`."""
+    return registry.as_dict()
+
+
+@contextmanager
+def profile(reset=True):
+    """Context manager: collect metrics inside the ``with`` block.
+
+    Parameters:
+        reset: bool, whether to zero the metrics on entry
+
+    Returns:
+        the global `Registry`; call its ``as_dict()`` after (or during) the block.
+
+    Instrumentation is disabled on exit, unless it was already enabled on entry.
+    """
+    was_enabled = is_enabled()
+    if reset:
+        registry.reset()
+    enable()
+    try:
+        yield registry
+    finally:
+        if not was_enabled:
+            disable()
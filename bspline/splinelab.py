@@ -15,11 +15,24 @@ Created on Fri Mar 24 13:52:37 2017
 
 from __future__ import division, print_function, absolute_import
 
+from collections import namedtuple
+import math
+
 import numpy as np
 
 import bspline.bspline
 
 
+PPForm = namedtuple("PPForm", ["breaks", "coefs"])
+PPForm.__doc__ = """Piecewise-polynomial form of a spline (see `fn2fm`).
+
+    breaks: rank-1 array of l+1 increasing breakpoints
+    coefs:  array of shape (l, p+1) (or (l, p+1, m) for an m-valued spline); coefs[i] are the
+            coefficients of the polynomial piece on [breaks[i], breaks[i+1]] in the local variable
+            ``x - breaks[i]``, highest power first (as in MATLAB)
+"""
+
+
 def augknt(knots, order):
     """Augment a knot vector.
 
@@ -68,14 +81,21 @@ Caveat:
     if t.ndim > 1:
         raise ValueError("t must be a list or a rank-1 array")
 
+    if k < 1:
+        raise ValueError("k must be >= 1, but got %d" % (k))
+
     n = t.shape[0]
     u = max(0, n - (k-1))  # number of elements in the output array
-    out = np.empty( (u,), dtype=t.dtype )
 
-    for j in range(u):
-        out[j] = sum( t[j:(j+k)] ) / k
+    # Sum k shifted slices. This performs the additions in the same order as
+    # sum( t[j:(j+k)] ) for each j, so the result is exact to the last bit
+    # (unlike a difference of cumulative sums, which loses precision for long inputs).
+    #
+    acc = np.zeros( (u,), dtype=t.dtype )
+    for i in range(k):
+        acc += t[i:(i+u)]
 
-    return out
+    return (acc / k).astype(t.dtype, copy=False)
 
 
 def aptknt(tau, order):
@@ -108,6 +128,8 @@ Returns:
 
     if tau.ndim > 1:
         raise ValueError("tau must be a list or a rank-1 array")
+    if tau.shape[0] == 0:
+        raise ValueError("tau must not be empty")
 
     # emulate MATLAB behavior for the "k" parameter
     #
@@ -117,7 +139,7 @@ Returns:
     if len(tau) < k:
         k = len(tau)
 
-    if not (tau == sorted(tau)).all():
+    if np.any( tau[1:] < tau[:-1] ):
         raise ValueError("tau must be nondecreasing")
 
     # last processed element needs to be:
@@ -126,14 +148,10 @@ Returns:
     # =>  i = len(tau) - k
     #
     u = len(tau) - k
-    for i in range(u):
-        if tau[i+k-1] == tau[i]:
-            raise ValueError("k-fold (or higher) repeated sites not allowed, but tau[i+k-1] == tau[i] for i = %d, k = %d" % (i,k))
-
-    # form the output sequence
-    #
-    prefix = [ tau[0]  ] * k
-    suffix = [ tau[-1] ] * k
+    repeated = np.nonzero( tau[(k-1):(k-1+u)] == tau[:u] )[0]
+    if repeated.shape[0]:
+        i = repeated[0]
+        raise ValueError("k-fold (or higher) repeated sites not allowed, but tau[i+k-1] == tau[i] for i = %d, k = %d" % (i,k))
 
     # https://se.mathworks.com/help/curvefit/aveknt.html
     # MATLAB's aveknt():
@@ -141,8 +159,10 @@ Returns:
     #  - seems to ignore the endpoints
     #
     tmp    = aveknt(tau[1:-1], k-1)
-    middle = tmp.tolist()
-    return np.array( prefix + middle + suffix, dtype=tmp.dtype )
+
+    # form the output sequence: k copies of tau[0], the averages, and k copies of tau[-1]
+    #
+    return np.concatenate( (np.repeat(tau[:1], k), tmp, np.repeat(tau[-1:], k)) ).astype(tmp.dtype, copy=False)
 
 
 def knt2mlt(t):
@@ -169,20 +189,35 @@ Caveat:
     if t.ndim > 1:
         raise ValueError("t must be a list or a rank-1 array")
 
-    out   = []
-    e     = None
-    for k in range(t.shape[0]):
-        if t[k] != e:
-            e     = t[k]
-            count = 0
-        else:
-            count += 1
-        out.append(count)
+    # out[k] = k - (index where the run of equal elements containing t[k] starts)
+    #
+    n          = t.shape[0]
+    idx        = np.arange(n)
+    run_starts = np.concatenate( ([True], t[1:] != t[:-1]) )[:n]
+    return idx - np.maximum.accumulate( np.where(run_starts, idx, 0) )
+
+
+def _spcol_local(B, tau, m):
+    """Local basis values for the rows of `spcol` (for internal use).
 
-    return np.array( out )
+    Parameters:
+        B: Bspline object
+        tau: rank-1 array, collocation sites
+        m: rank-1 int array, derivative order for each site (see `knt2mlt`)
 
+    Returns:
+        (N, start) as in `bspline.Bspline.local_basis`, with row i holding D**{m[i]} at tau[i].
+    """
+    # evaluate all sites of the same multiplicity (i.e. derivative order) at once
+    N     = np.empty( (tau.shape[0], B.p + 1), dtype=B.dtype )
+    start = np.empty( (tau.shape[0],), dtype=int )
+    for mi in np.unique(m):
+        sel = (m == mi)
+        N[sel], start[sel] = B.local_basis(tau[sel], deriv_order=mi)
+    return N, start
 
-def spcol(knots, order, tau):
+
+def spcol(knots, order, tau, sparse=False, workers=1, dtype=None):
     """Return collocation matrix.
 
 Minimal emulation of MATLAB's ``spcol``.
@@ -194,6 +229,16 @@ Parameters:
         int, >= 0, order of spline
     tau:
         rank-1 array, collocation sites
+    sparse:
+        bool. If True, return the matrix in compressed sparse row (CSR) format,
+        built from the local support of the basis without forming the dense matrix
+        (like MATLAB's ``spcol(..., 'sparse')``). See `bspline.Bspline.collmat`.
+    workers:
+        int, >= 1, number of threads for evaluating the basis (see `bspline.Bspline`)
+    dtype:
+        None, or a NumPy floating-point dtype (e.g. np.float32) in which to evaluate the basis
+        and allocate the matrix (see `bspline.Bspline` for the accuracy). The default None
+        computes in float64 (or in the dtype of `knots`, if wider).
 
 Returns:
     rank-2 array A such that
@@ -204,17 +249,283 @@ Returns:
         m(i) = multiplicity of site tau[i]
 
         D**k  = kth derivative (0 for function value itself)
+
+    If sparse=True, a scipy.sparse.csr_matrix (or, if SciPy is not installed, the tuple
+    (data, indices, indptr, shape) of CSR arrays).
 """
+    tau = np.atleast_1d(tau)
     m = knt2mlt(tau)
-    B = bspline.Bspline(knots, order)
+    B = bspline.Bspline(knots, order, workers=workers, dtype=dtype)
 
-    dummy = B(0.)
-    nbasis = len(dummy)  # perform dummy evaluation to get number of basis functions
+    N, start = _spcol_local(B, tau, m)
+    cols     = start[:, np.newaxis] + np.arange(B.p + 1)
+    if sparse:
+        return bspline.bspline._local_to_csr(N, cols, B.n_basis)
 
-    A = np.empty( (tau.shape[0], nbasis), dtype=dummy.dtype )
-    for i,item in enumerate(zip(tau,m)):
-        taui,mi = item
-        f       = B.diff(order=mi)
-        A[i,:]  = f(taui)
+    # scatter the local values into the dense rows
+    A       = np.zeros( (tau.shape[0], B.n_basis), dtype=B.dtype )
+    valid   = (cols >= 0) & (cols < B.n_basis)
+    rows, j = np.nonzero(valid)
+    A[rows, cols[valid]] = N[rows, j]
 
     return A
+
+
+def spapi(knots, order, tau, y):
+    """Spline interpolation.
+
+Minimal emulation of MATLAB's ``spapi``.
+
+Find the spline of the given `order` on `knots` that interpolates the data `y` at the sites `tau`.
+As in `spcol`, a site repeated r times picks up derivatives up to order r-1 (Hermite interpolation).
+
+The interpolation matrix is banded (for sorted sites); it is assembled in banded form from the
+local basis values and solved by banded LU decomposition (`scipy.linalg.solve_banded`), at
+O(n * p**2) cost. Without SciPy, or if the knots are wider than float64 (np.longdouble), the normal
+equations are solved by banded Cholesky instead.
+
+Parameters:
+    knots:
+        rank-1 array, knot vector (with appropriately repeated endpoints; see `augknt`, `aptknt`)
+    order:
+        int, >= 0, order of spline
+    tau:
+        rank-1 array, interpolation sites, sorted, one per basis function
+        (``len(knots) - order - 1`` sites). See `aptknt` for a suitable knot vector.
+        A site at the right endpoint of the knot vector is interpolated by the limit from the left.
+    y:
+        rank-1 array of data values at `tau` (derivative values for repeated sites),
+        or rank-2 array of shape (len(tau), m) for m-valued data
+
+Returns:
+    bspline.Spline object
+"""
+    tau = np.atleast_1d(tau)
+    y   = np.asanyarray(y)
+    B   = bspline.Bspline(knots, order)
+    n   = B.n_basis
+    if tau.ndim > 1  or  tau.shape[0] != n:
+        raise ValueError("tau must be a rank-1 array with one site per basis function (%d)" % (n))
+    if y.ndim not in (1, 2)  or  y.shape[0] != n:
+        raise ValueError("y must have one row per site (%d), but got shape %s" % (n, y.shape))
+
+    # The basis is evaluated on half-open intervals, so at the right endpoint of the knot vector
+    # all basis functions are zero. For interpolation, use the limit from the left there instead.
+    #
+    t_end    = B.knot_vector[-1]
+    tau_eval = np.where( tau == t_end, np.nextafter(t_end, -np.inf), tau )
+    N, start = _spcol_local(B, tau_eval, knt2mlt(tau))
+
+    # LAPACK computes in float64 at most; keep a wider dtype of the basis (np.longdouble)
+    lapack = np.can_cast(B.dtype, np.float64)
+    if lapack:
+        try:
+            import scipy.linalg
+        except ImportError:
+            lapack = False
+    if not lapack:
+        ne = bspline.bspline.NormalEquations(B)
+        ne.add_local(N, start, y)
+        return ne.solve()
+
+    # A[i,j] -> ab[u + i - j, j]  (storage format of scipy.linalg.solve_banded)
+    cols    = start[:, np.newaxis] + np.arange(B.p + 1)
+    rows, j = np.nonzero( (cols >= 0) & (cols < n) )
+    cols    = cols[rows, j]
+    offset  = rows - cols
+    l       = max(0, np.max(offset))
+    u       = max(0, -np.min(offset))
+    ab      = np.zeros( (l + u + 1, n) )
+    ab[u + offset, cols] = N[rows, j]
+    return bspline.Spline( B, scipy.linalg.solve_banded((l, u), ab, y) )
+
+
+def spap2(knots, order, x, y, w=None):
+    """Least-squares spline approximation.
+
+Minimal emulation of MATLAB's ``spap2``.
+
+Find the spline of the given `order` on `knots` that minimizes
+``sum( w * (f(x) - y)**2 )``. The normal equations are built directly in banded form
+and solved by banded Cholesky decomposition, at O(len(x) * p**2 + n * p**2) cost;
+see `bspline.bspline.NormalEquations`.
+
+Parameters:
+    knots:
+        rank-1 array, knot vector (with appropriately repeated endpoints; see `augknt`, `aptknt`)
+    order:
+        int, >= 0, order of spline
+    x:
+        rank-1 array, data sites
+    y:
+        rank-1 array of data values, or rank-2 array of shape (len(x), m) for m-valued data
+    w:
+        rank-1 array of nonnegative weights, or None (unit weights)
+
+    The data are processed in chunks, so x, y and w may also be memory-mapped arrays
+    (e.g. from ``np.load(filename, mmap_mode='r')``) larger than the available memory.
+
+Returns:
+    bspline.Spline object
+"""
+    ne = bspline.bspline.NormalEquations( bspline.Bspline(knots, order) )
+    ne.add_chunks(x, y, w)  # bounds temporary memory; x, y, w may also be memory-mapped arrays
+    return ne.solve()
+
+
+def sp2pp(f):
+    """Convert a spline from B-form to piecewise-polynomial form.
+
+Minimal emulation of MATLAB's ``fn2fm(f, 'pp')`` for splines in B-form.
+
+The coefficients of each piece are the Taylor coefficients at its left breakpoint, computed
+from one batched evaluation of all derivatives up to order p at the breakpoints.
+
+Parameters:
+    f:
+        bspline.Spline object
+
+Returns:
+    PPForm(breaks, coefs). The breaks are the distinct knots of ``f.basis``.
+"""
+    B      = f.basis
+    p      = B.p
+    breaks = np.unique(B.knot_vector)
+    if breaks.shape[0] < 2  or  B.n_basis == 0:
+        raise ValueError("the spline must have at least one nonzero-length knot interval")
+
+    D    = f.derivatives(breaks[:-1], p)  # D[i,k(,:)] = D**k f(breaks[i]), from the right
+    fact = np.array( [math.factorial(k) for k in range(p+1)], dtype=np.float64 )
+    fact = fact.reshape( fact.shape + (1,)*(D.ndim - 2) )
+    return PPForm( breaks, (D / fact)[:, ::-1] )
+
+
+def _check_pp(pp):
+    """Return the breaks and coefficients of a pp-form as arrays, after checking their shapes (for internal use)."""
+    breaks, coefs = pp
+    breaks = np.asarray(breaks)
+    coefs  = np.asarray(coefs)
+    if breaks.ndim != 1  or  breaks.shape[0] < 2  or  not (breaks[-1] > breaks[0]):
+        raise ValueError("the spline must have at least one nonzero-length knot interval")
+    if coefs.ndim < 2  or  coefs.shape[0] != breaks.shape[0] - 1:
+        raise ValueError("coefs must have one row per interval (%d), but got shape %s" % (breaks.shape[0] - 1, coefs.shape))
+    return breaks, coefs
+
+
+def _interval_index(breaks, x):
+    """Return the index i of the interval [breaks[i], breaks[i+1]) containing each site (for internal use).
+
+    Sites outside the breaks get the first or last interval. Equispaced breaks are handled by one
+    floor division instead of a binary search.
+    """
+    l = breaks.shape[0] - 1
+    h = (breaks[-1] - breaks[0]) / l
+    if np.all( np.abs( np.diff(breaks) - h ) <= 8. * np.finfo(np.float64).eps * np.max(np.abs(breaks)) ):
+        i  = np.floor( (x - breaks[0]) / h )
+        i  = np.clip( np.where(np.isfinite(i), i, 0), 0, l-1 ).astype(np.intp)
+        i -= (x < breaks[i]) & (i > 0)     # correct rounding errors of the division
+        i += (x >= breaks[i+1]) & (i < l-1)
+        return i
+    return np.clip( np.searchsorted(breaks, x, side='right') - 1, 0, l-1 )
+
+
+def ppval(pp, x):
+    """Evaluate a spline in piecewise-polynomial form.
+
+Minimal emulation of MATLAB's ``ppval``.
+
+Each site is located among the breaks by one floor division if the breaks are equispaced, otherwise
+by binary search, and the piece is evaluated by Horner's rule, at O(p) or O(log(l) + p) cost per site.
+
+Parameters:
+    pp:
+        PPForm(breaks, coefs), e.g. from `sp2pp`
+    x:
+        scalar, or Python list or rank-1 array of sites
+
+Returns:
+    values at `x`: a scalar or rank-1 array of length m (for a single site), or an array
+    of shape (len(x),) or (len(x), m) (for an array of sites).
+
+Caveat:
+    As in MATLAB, sites outside [breaks[0], breaks[-1]) are evaluated by extending the first or last
+    piece. (In B-form, the spline is zero there.) In particular, at the right endpoint this gives the
+    limit from the left.
+"""
+    breaks, coefs = _check_pp(pp)
+    x_in = np.asanyarray(x)
+    x    = np.atleast_1d(x_in)
+    if x.ndim > 1:
+        raise ValueError("x must be a scalar or a rank-1 array, but got rank = %d" % (x.ndim))
+
+    idx = _interval_index(breaks, x)
+    dx  = x - breaks[idx]
+    dx  = dx.reshape( dx.shape + (1,)*(coefs.ndim - 2) )
+
+    # Horner's rule, gathering one power at a time from contiguous coefficient rows
+    c = np.moveaxis(coefs, 1, 0)
+    v = np.take(c[0], idx, axis=0).astype(np.result_type(coefs, dx), copy=False)  # e.g. integer coefs
+    for j in range(1, c.shape[0]):
+        v *= dx
+        v += np.take(c[j], idx, axis=0)
+
+    if x_in.ndim == 0:
+        return v[0]
+    return v
+
+
+def pp2sp(pp, knots=None):
+    """Convert a spline from piecewise-polynomial form to B-form.
+
+Minimal emulation of MATLAB's ``fn2fm(f, 'B-')`` for splines in pp-form.
+
+The B-form is found by interpolation (`spapi`) at the Greville sites of the knot vector, which is
+exact (up to rounding) when the piecewise polynomial lies in the spline space of `knots`.
+
+Parameters:
+    pp:
+        PPForm(breaks, coefs), e.g. from `sp2pp`
+    knots:
+        rank-1 array, knot vector of the result, with interior multiplicities at most p
+        (where p+1 = ``coefs.shape[1]``). The default ``augknt(breaks, p)`` is the space
+        of splines with p-1 continuous derivatives at the breaks, which contains the result of
+        `sp2pp` for any spline on simple knots.
+
+Returns:
+    bspline.Spline object
+"""
+    breaks, coefs = _check_pp(pp)
+    p = coefs.shape[1] - 1
+    if knots is None:
+        knots = augknt(breaks, p)
+    knots = np.atleast_1d(knots)
+
+    if p > 0:
+        tau = aveknt(knots[1:-1], p)              # Greville sites
+    else:
+        tau = (knots[:-1] + knots[1:]) / 2.      # interval midpoints
+    return spapi( knots, p, tau, ppval(PPForm(breaks, coefs), tau) )
+
+
+def fn2fm(f, form, knots=None):
+    """Convert a spline to the given form.
+
+Minimal emulation of MATLAB's ``fn2fm``.
+
+Parameters:
+    f:
+        bspline.Spline object (B-form) or PPForm (pp-form)
+    form:
+        "pp" for piecewise-polynomial form (see `sp2pp`), or "B-" for B-form (see `pp2sp`)
+    knots:
+        knot vector of the B-form result (see `pp2sp`); ignored for "pp"
+
+Returns:
+    PPForm or bspline.Spline object. A spline already in the requested form is returned as-is.
+"""
+    if form == "pp":
+        return f if isinstance(f, PPForm) else sp2pp(f)
+    elif form == "B-":
+        return pp2sp(f, knots) if isinstance(f, PPForm) else f
+    else:
+        raise ValueError("form must be 'pp' or 'B-', but got '%s'" % (form))
@@ -170,6 +170,7 @@ setup(
     #
     setup_requires = [],
     install_requires = ["numpy"],
+    extras_require = {"fast": ["numba"], "sparse": ["scipy"]},
     provides = ["bspline"],
 
     # keywords for PyPI (in case you upload your project)
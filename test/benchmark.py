@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Benchmark suite for bspline.
+
+Times basis evaluation, derivatives, collocation and the splinelab helpers,
+sweeping the number of knots, the spline order and the number of sites.
+The results are written as JSON, so that runs on different commits can be compared.
+
+Usage, from the root of the repository (so that the bspline package there is benchmarked):
+    PYTHONPATH=. python test/benchmark.py                               # full sweep, write benchmark.json
+    PYTHONPATH=. python test/benchmark.py --quick -o new.json           # small sweep
+    PYTHONPATH=. python test/benchmark.py --quick --compare old.json    # also print timing ratios new/old
+
+Cases that the benchmarked version of bspline does not support (e.g. an older commit, before
+sparse collocation or batched evaluation) raise TypeError, and are skipped. To benchmark an
+older commit, copy this script out of the tree first.
+
+Each timing is the best of several repeats of the wall-clock time of one call,
+after one untimed warm-up call (which also triggers JIT compilation of the Numba kernels).
+Scalar evaluation is timed with memoization turned off (cache_size=0),
+so that repeats measure actual evaluation; it is skipped where memoization cannot be turned off.
+
+The evaluation backend (see `bspline.bspline.get_backend`) and the Numba version are
+recorded in the metadata; compare only runs with the same backend.
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+import numpy as np
+
+import bspline
+import bspline.splinelab as splinelab
+
+
+# sweep parameters
+FULL  = { "nknots" : (10, 100, 1000),
+          "orders" : (1, 3, 5),
+          "nsites" : (100, 10000) }
+QUICK = { "nknots" : (10, 100),
+          "orders" : (1, 3),
+          "nsites" : (100, 1000) }
+
+# cap on the number of sites for the per-site (scalar) loops, to keep the total run time sane
+MAX_SCALAR_SITES = 1000
+
+
+def best_time(f, repeat):
+    """Return the best wall-clock time (in seconds) of `repeat` calls of f(), after one untimed call."""
+    f()
+    return min( timeit.repeat(f, number=1, repeat=repeat) )
+
+
+def cases(nknots, order, nsites):
+    """Yield (name, callable) for all benchmarks of one (nknots, order, nsites) configuration."""
+    knots  = splinelab.augknt( np.linspace(0, 1, nknots), order )
+    B      = bspline.Bspline(knots, order)
+    x      = np.linspace(0, 1, nsites, endpoint=False)
+    xs     = x[:MAX_SCALAR_SITES]
+    tau    = np.sort( np.concatenate( (x, x[::10]) ) )  # every tenth site doubled -> first derivatives in spcol
+
+    try:
+        Bs = bspline.Bspline(knots, order, cache_size=0)
+    except TypeError:  # no cache_size: repeats would time cache hits, so skip the scalar cases
+        Bs = None
+
+    if Bs is not None:
+        yield "call_scalar", lambda: [Bs(xi) for xi in xs]
+    yield "call_batch",  lambda: B(x)
+    if Bs is not None:
+        yield "d_scalar",    lambda: [Bs.d(xi) for xi in xs]
+    yield "d_batch",     lambda: B.d(x)
+    for k in range(1, 5):
+        yield "diff%d" % (k), lambda k=k: B.diff(order=k)(x)
+    yield "collmat",        lambda: B.collmat(x)
+    yield "collmat_deriv2", lambda: B.collmat(x, deriv_order=2)
+    yield "collmat_sparse", lambda: B.collmat(x, sparse=True)
+    yield "spcol",          lambda: splinelab.spcol(knots, order, tau)
+    yield "aptknt",         lambda: splinelab.aptknt(x, order)
+    yield "aveknt",         lambda: splinelab.aveknt(x, order + 1)
+
+
+def numba_version():
+    """Return the version of Numba, or None if it is not installed."""
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba.__version__
+
+
+def backend():
+    """Return the evaluation backend, or None for versions of bspline without a choice of backend."""
+    get_backend = getattr(bspline.bspline, "get_backend", None)
+    return None if get_backend is None else get_backend()
+
+
+def git_revision():
+    """Return the current git commit hash of the repository containing the benchmarked bspline package, or None."""
+    try:
+        out = subprocess.check_output( ["git", "rev-parse", "HEAD"], stderr=subprocess.STDOUT,
+                                       cwd=os.path.dirname(os.path.abspath(bspline.__file__)) )
+        return out.decode("ascii").strip()
+    except Exception:
+        return None
+
+
+def run(sweep, repeat, verbose=True):
+    """Run the benchmarks. Return a dict with keys "meta" and "results"."""
+    results = []
+    for nknots in sweep["nknots"]:
+        for order in sweep["orders"]:
+            for nsites in sweep["nsites"]:
+                for name,f in cases(nknots, order, nsites):
+                    try:
+                        t = best_time(f, repeat)
+                    except TypeError:  # not supported by this version of bspline
+                        if verbose:
+                            print( "%-16s nknots=%-5d order=%d nsites=%-6d      skipped" % (name, nknots, order, nsites) )
+                        continue
+                    nsites_timed = min(nsites, MAX_SCALAR_SITES) if name.endswith("_scalar") else nsites
+                    results.append( { "name"    : name,
+                                      "nknots"  : nknots,
+                                      "order"   : order,
+                                      "nsites"  : nsites_timed,
+                                      "seconds" : t } )
+                    if verbose:
+                        print( "%-16s nknots=%-5d order=%d nsites=%-6d %12.6f s" % (name, nknots, order, nsites_timed, t) )
+
+    meta = { "bspline_version" : bspline.__version__,
+             "git_revision"    : git_revision(),
+             "python"          : platform.python_version(),
+             "numpy"           : np.__version__,
+             "backend"         : backend(),
+             "numba"           : numba_version(),
+             "platform"        : platform.platform(),
+             "repeat"          : repeat }
+    return { "meta" : meta, "results" : results }
+
+
+def compare(old, new):
+    """Print the ratio of timings new/old for all benchmarks present in both result sets."""
+    key = lambda r: (r["name"], r["nknots"], r["order"], r["nsites"])
+    old_times = dict( (key(r), r["seconds"]) for r in old["results"] )
+
+    old_backend = old["meta"].get("backend")
+    new_backend = new["meta"].get("backend")
+    if old_backend != new_backend  and  None not in (old_backend, new_backend):  # None: before the choice of backend
+        print( "WARNING: comparing different evaluation backends (old: %s, new: %s)" % (old_backend, new_backend), file=sys.stderr )
+
+    print( "%-16s %6s %5s %6s %12s %12s %8s" % ("name", "nknots", "order", "nsites", "old [s]", "new [s]", "new/old") )
+    for r in new["results"]:
+        k = key(r)
+        if k in old_times:
+            print( "%-16s %6d %5d %6d %12.6f %12.6f %8.3f" % (k + (old_times[k], r["seconds"], r["seconds"] / old_times[k])) )
+
+
+def main():
+    parser = argparse.ArgumentParser( description="Benchmark suite for bspline." )
+    parser.add_argument( "-o", "--output", default="benchmark.json", help="JSON file to write the results to" )
+    parser.add_argument( "-r", "--repeat", type=int, default=5, help="number of repeats per timing (best is reported)" )
+    parser.add_argument( "--quick", action="store_true", help="run a smaller sweep" )
+    parser.add_argument( "--compare", metavar="OLD", default=None, help="JSON file from an earlier run to compare against" )
+    args = parser.parse_args()
+
+    data = run( QUICK if args.quick else FULL, args.repeat )
+    with open(args.output, "w") as f:
+        json.dump( data, f, indent=1 )
+    print( "Results written to '%s'" % (args.output), file=sys.stderr )
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        compare(old, data)
+
+
+if __name__ == '__main__':
+    main()
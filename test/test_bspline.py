@@ -0,0 +1,704 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for bspline.bspline and bspline.splinelab.
+
+Run with e.g. ``python -m pytest test`` (or nosetests).
+"""
+
+from __future__ import division, print_function, absolute_import
+
+import importlib
+import sys
+
+import numpy as np
+
+import bspline
+import bspline.splinelab as splinelab
+
+
+def make_basis(p=3, nknots=5):
+    """Return a clamped basis of order p on nknots uniform knots in [0,1], and the knot vector."""
+    knots = splinelab.augknt( np.linspace(0,1,nknots), p )
+    return bspline.Bspline(knots, p), knots
+
+
+def have_scipy():
+    """Return whether scipy.sparse and scipy.linalg are available; SciPy is optional."""
+    try:
+        importlib.import_module("scipy.sparse")
+        importlib.import_module("scipy.linalg")
+    except ImportError:
+        return False
+    return True
+
+
+def csr_parts(A):
+    """Return (data, indices, indptr, shape) of a sparse result: a scipy.sparse.csr_matrix, or the tuple of its CSR arrays returned without SciPy."""
+    if isinstance(A, tuple):
+        return A
+    assert A.format == "csr"
+    return (A.data, A.indices, A.indptr, A.shape)
+
+
+def to_dense(A):
+    """Expand a sparse result (see `csr_parts`) into a dense array."""
+    data, indices, indptr, shape = csr_parts(A)
+    D = np.zeros( shape, dtype=data.dtype )
+    D[ np.repeat( np.arange(shape[0]), np.diff(indptr) ), indices ] = data
+    return D
+
+
+def test_batched_call_matches_scalar():
+    for p in range(4):
+        B,_ = make_basis(p)
+        x   = np.linspace(-0.1, 1.1, 37)
+
+        A  = B(x)
+        dA = B.d(x)
+        assert A.shape  == (len(x), len(B(0.)))
+        assert dA.shape == A.shape
+        for i,xi in enumerate(x):
+            assert np.allclose( A[i],  B(xi) )
+            assert np.allclose( dA[i], B.d(xi) )
+
+
+def test_batched_diff_and_collmat():
+    B,_ = make_basis(3)
+    x   = np.linspace(0, 0.99, 11)
+    for order in range(5):
+        f = B.diff(order=order)
+        A = B.collmat(x, deriv_order=order)
+        assert np.allclose( A, np.array([f(xi) for xi in x]) )
+        assert np.allclose( f(x), A )
+
+
+def test_local_basis():
+    # clamped, repeated interior knots, and no endpoint repeats at all
+    knot_vectors = ( [0,0,0,0,0,1,2,2,3,3,3,4,4,4,4,5,5,5,5,5],
+                     [0,1,2,3,4,5],
+                     [0,0,1,1,1,2,3,3] )
+    for kv in knot_vectors:
+        for p in range(5):
+            B = bspline.Bspline(kv, p)
+            x = np.concatenate( (np.linspace(-0.5, 5.5, 61), kv) )
+            nbasis = len(B(0.))
+
+            N,start = B.local_basis(x)
+            assert N.shape == (len(x), p+1)
+            for i,xi in enumerate(x):
+                full = B(xi)
+                cols = start[i] + np.arange(p+1)
+                ok   = (cols >= 0) & (cols < nbasis)
+                assert np.allclose( N[i][ok], full[cols[ok]] )
+                assert np.allclose( N[i][~ok], 0. )
+                assert np.isclose( np.sum(N[i]), np.sum(full) )  # no other nonzeros
+
+
+def test_sparse_collmat_and_spcol():
+    p = 3
+    B,knots = make_basis(p, nknots=8)
+    x = np.linspace(-0.1, 1.1, 41)
+    for order in range(5):
+        A = B.collmat(x, deriv_order=order, sparse=True)
+        assert isinstance(A, tuple) != have_scipy()
+        assert np.max( np.diff(csr_parts(A)[2]) ) <= p+1
+        assert np.allclose( to_dense(A), B.collmat(x, deriv_order=order) )
+
+    # Hermite-type sites: repeated sites pick up derivatives
+    tau = np.array( [0., 0., 0.2, 0.5, 0.5, 0.5, 0.7, 0.99] )
+    A   = splinelab.spcol(knots, p, tau, sparse=True)
+    assert np.allclose( to_dense(A), splinelab.spcol(knots, p, tau) )
+
+
+def test_without_scipy():
+    # hide SciPy, so that the CSR-array, sparse-product and banded Cholesky fallbacks are used
+    hidden = dict( (name, sys.modules.get(name)) for name in ("scipy", "scipy.sparse", "scipy.linalg") )
+    sys.modules.update( dict.fromkeys(hidden) )
+    try:
+        p = 3
+        B,knots = make_basis(p, nknots=8)
+        x = np.linspace(-0.1, 1.1, 41)
+        for order in range(3):
+            A = B.collmat(x, deriv_order=order, sparse=True)
+            assert isinstance(A, tuple)
+            assert np.allclose( to_dense(A), B.collmat(x, deriv_order=order) )
+        tau = np.array( [0., 0., 0.2, 0.5, 0.5, 0.7, 0.99] )
+        A   = splinelab.spcol(knots, p, tau, sparse=True)
+        assert isinstance(A, tuple)
+        assert np.allclose( to_dense(A), splinelab.spcol(knots, p, tau) )
+
+        # knot insertion matrix, and products with it
+        B2, T = B.insert_knots([0.3, 0.3, 0.65])
+        assert isinstance(T, tuple)
+        c = np.random.RandomState(0).randn(B.n_basis, 2)
+        assert np.allclose( bspline.bspline._csr_dot(T, c), to_dense(T).dot(c) )
+        assert np.allclose( B2(x).dot( to_dense(T) ), B(x) )
+
+        # many coefficient columns on one basis
+        C = np.random.RandomState(1).randn(B.n_basis, 7)
+        assert np.allclose( bspline.Spline(B, C)(x), B.collmat(x).dot(C) )
+
+        # banded Cholesky solve, against a dense solve
+        rng = np.random.RandomState(2)
+        xs  = np.sort( rng.uniform(0, 1, 200) )
+        y   = np.cos(4*xs) + 0.01 * rng.randn(200)
+        Ad  = B.collmat(xs)
+        ne  = bspline.bspline.NormalEquations(B)
+        ne.add_chunks(xs, y, chunksize=64)
+        assert np.allclose( ne.solve().coeffs, np.linalg.solve( Ad.T.dot(Ad), Ad.T.dot(y) ) )
+
+        # interpolation through the same fallback
+        tau = np.linspace(0, 1, 12)
+        k   = splinelab.aptknt(tau, p)
+        f   = splinelab.spapi(k, p, tau, np.sin(3*tau))
+        assert np.allclose( f(tau[:-1]), np.sin(3*tau[:-1]) )
+    finally:
+        for name, module in hidden.items():
+            if module is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = module
+
+
+def test_cache_bounded():
+    knots = splinelab.augknt( np.linspace(0,1,5), 3 )
+
+    B = bspline.Bspline(knots, 3, cache_size=4)
+    B.cache_clear()
+    for x in np.linspace(0, 1, 20):
+        B(x)
+    B(1.)  # most recent entry -> hit
+    info = B.cache_info()
+    assert info.currsize == 4  and  info.maxsize == 4
+    assert info.hits == 1  and  info.misses == 20
+
+    B = bspline.Bspline(knots, 3, cache_size=0)
+    y = B(0.3)
+    assert np.allclose( B(0.3), y )
+    assert B.cache_info().currsize == 0  and  B.cache_info().hits == 0
+
+
+def test_derivatives_table():
+    p = 4
+    B,_ = make_basis(p, nknots=7)
+    x   = np.linspace(0, 0.99, 23)
+
+    D = B.derivatives(x, 6)
+    assert D.shape == (len(x), 7, len(B(0.)))
+    assert np.allclose( D[:,0], B(x) )
+    assert np.allclose( D[:,1], B.d(x) )
+    assert np.allclose( D[:,p+1:], 0. )
+    assert np.allclose( B.derivatives(0.3, 2), B.derivatives(np.array([0.3]), 2)[0] )
+    assert np.allclose( B.diff(2)(np.array(0.3)), B.derivatives(0.3, 2)[2] )  # rank-0 array site
+
+    # check against finite differences of the next lower derivative
+    # (away from the knots, where the highest derivative jumps)
+    x = np.linspace(0.01, 0.98, 23)
+    D = B.derivatives(x, p)
+    h = 1e-6
+    for k in range(1, p+1):
+        fd = (B.diff(k-1)(x + h) - B.diff(k-1)(x - h)) / (2*h)
+        assert np.allclose( D[:,k], fd, rtol=1e-4, atol=1e-4 * np.max(np.abs(D[:,k])) )
+
+
+def test_spline_function():
+    p = 3
+    B,_ = make_basis(p, nknots=9)
+    x   = np.linspace(0, 0.999, 31)
+    nbasis = len(B(0.))
+
+    c = np.sin( np.arange(nbasis) )
+    f = bspline.Spline(B, c)
+    for k in range(p+2):
+        assert np.allclose( f.diff(k)(x), B.collmat(x, deriv_order=k).dot(c) )
+        assert np.allclose( f.diff(k)(0.3), B.diff(k)(0.3).dot(c) )
+
+    # curve in R**2
+    C = np.stack( (c, np.cos( np.arange(nbasis) )), axis=1 )
+    g = bspline.Spline(B, C)
+    assert g(x).shape == (len(x), 2)  and  g(0.3).shape == (2,)
+    assert np.allclose( g.d(x), B.d(x).dot(C) )
+    assert np.allclose( g.derivatives(x, 2)[:,2,:], B.collmat(x, deriv_order=2).dot(C) )
+
+
+def test_cheap_construction():
+    B,knots = make_basis(3)
+    assert B.cache_info().misses == 0  # nothing evaluated yet
+    assert B.n_basis == len(B(0.)) == len(knots) - 4
+    assert B.dtype == B(0.).dtype
+
+
+def test_splinelab_helpers():
+    assert np.array_equal( splinelab.knt2mlt([1, 1, 2, 3, 3, 3]), [0, 1, 0, 0, 1, 2] )
+    assert np.allclose( splinelab.aveknt([0., 1., 2., 4.], 2), [0.5, 1.5, 3.] )
+    assert splinelab.aveknt([0., 1.], 3).shape == (0,)
+
+    tau = np.linspace(0, 1, 7)
+    k   = splinelab.aptknt(tau, 3)
+    assert np.allclose( k[:4], 0. )  and  np.allclose( k[-4:], 1. )
+    assert np.allclose( k[4:-4], splinelab.aveknt(tau[1:-1], 3) )
+
+    for bad in ( [0., 0.5, 0.2, 1.],              # not sorted
+                 [0., 0.5, 0.5, 0.5, 0.5, 1.] ):  # 4-fold site for cubic
+        try:
+            splinelab.aptknt(bad, 3)
+        except ValueError:
+            pass
+        else:
+            assert False, "aptknt should have rejected %s" % (bad)
+
+
+def test_tensor_product_basis():
+    Bx,kx = make_basis(3, nknots=5)
+    By,ky = make_basis(2, nknots=4)
+    T     = bspline.TensorBspline( (kx, ky), (3, 2) )
+    assert T.shape == (Bx.n_basis, By.n_basis)
+
+    rng = np.random.RandomState(0)
+    pts = rng.uniform(0, 1, size=(50, 2))
+    for orders in ( (0,0), (1,0), (2,1) ):
+        A = T.collmat(pts, deriv_orders=orders)
+        Ax = Bx.collmat(pts[:,0], deriv_order=orders[0])
+        Ay = By.collmat(pts[:,1], deriv_order=orders[1])
+        expected = (Ax[:, :, np.newaxis] * Ay[:, np.newaxis, :]).reshape( (len(pts), -1) )
+        assert np.allclose( A, expected )
+
+        S = T.collmat(pts, deriv_orders=orders, sparse=True)
+        assert isinstance(S, tuple) != have_scipy()
+        assert np.max( np.diff(csr_parts(S)[2]) ) <= 4*3
+        assert np.allclose( to_dense(S), expected )
+
+    # partition of unity
+    assert np.allclose( T.collmat(pts).sum(axis=1), 1. )
+
+    # no points
+    assert T.collmat( np.zeros( (0, 2) ) ).shape == (0, T.n_basis)
+    assert csr_parts( T.collmat( np.zeros( (0, 2) ), sparse=True ) )[3] == (0, T.n_basis)
+
+
+def test_spapi_spap2():
+    p   = 3
+    tau = np.linspace(0, 1, 12)
+    k   = splinelab.aptknt(tau, p)
+
+    # interpolation
+    y = np.sin(3*tau)
+    f = splinelab.spapi(k, p, tau, y)
+    assert np.allclose( f(tau[:-1]), y[:-1] )
+    assert np.isclose( f(np.nextafter(1., 0.)), y[-1] )  # the right endpoint is not in the half-open domain
+    assert np.allclose( splinelab.spapi(k, float(p), tau, y).coeffs, f.coeffs )  # order given as a float
+
+    # Hermite: value and first derivative at a doubled site
+    sites = np.array( [0., 0., 0.3, 0.7, 0.9] )
+    knots = splinelab.augknt( [0., 0.5, 1.], p )
+    data  = np.array( [1., 2., 0.5, 0.25, 1.] )
+    g     = splinelab.spapi(knots, p, sites, data)
+    assert np.isclose( g(0.), 1. )  and  np.isclose( g.d(0.), 2. )
+    assert np.allclose( g(sites[2:]), data[2:] )
+
+    # weighted least squares, scalar- and vector-valued, against a dense solve
+    rng = np.random.RandomState(1)
+    x   = np.sort( rng.uniform(0, 1, 200) )
+    Y   = np.stack( (np.cos(4*x), x**2), axis=1 ) + 0.01 * rng.randn(200, 2)
+    w   = rng.uniform(0.5, 2., 200)
+    knots = splinelab.augknt( np.linspace(0, 1, 8), p )
+    B   = bspline.Bspline(knots, p)
+    A   = B.collmat(x)
+    expected = np.linalg.solve( A.T.dot(w[:, np.newaxis] * A), A.T.dot(w[:, np.newaxis] * Y) )
+    h   = splinelab.spap2(knots, p, x, Y, w)
+    assert np.allclose( h.coeffs, expected )
+    assert np.allclose( splinelab.spap2(knots, p, x, Y[:,0], w).coeffs, expected[:,0] )
+
+
+def test_chunked_collocation_and_fit():
+    import os
+    import tempfile
+
+    p = 3
+    knots = splinelab.augknt( np.linspace(0, 1, 6), p )
+    B = bspline.Bspline(knots, p)
+    x = np.linspace(0, 0.99, 101)
+    y = np.exp(x)
+
+    blocks = list( B.collmat_chunks(x, chunksize=30, deriv_order=1) )
+    assert [len(b) for b in blocks] == [30, 30, 30, 11]
+    assert np.allclose( np.concatenate(blocks), B.collmat(x, deriv_order=1) )
+
+    pieces = iter( [x[:50], x[50:]] )
+    blocks = list( B.collmat_chunks(pieces, chunksize=40, sparse=True) )
+    assert [csr_parts(b)[3][0] for b in blocks] == [40, 10, 40, 11]
+
+    # fit from memory-mapped files
+    d = tempfile.mkdtemp()
+    try:
+        np.save( os.path.join(d, "x.npy"), x )
+        np.save( os.path.join(d, "y.npy"), y )
+        xm = np.load( os.path.join(d, "x.npy"), mmap_mode='r' )
+        ym = np.load( os.path.join(d, "y.npy"), mmap_mode='r' )
+        ne = bspline.bspline.NormalEquations(B)
+        ne.add_chunks(xm, ym, chunksize=17)
+        f  = ne.solve()
+        del xm, ym
+    finally:
+        for name in ("x.npy", "y.npy"):
+            os.remove( os.path.join(d, name) )
+        os.rmdir(d)
+    assert np.allclose( f.coeffs, splinelab.spap2(knots, p, x, y).coeffs )
+
+    # data streams of different lengths
+    for n in (90, 95):
+        try:
+            bspline.bspline.NormalEquations(B).add_chunks(x[:100], y[:n], chunksize=30)
+        except ValueError:
+            pass
+        else:
+            assert False, "expected ValueError for streams of different lengths"
+
+
+def test_parallel_evaluation():
+    B,knots = make_basis(3, nknots=20)
+    Bp      = bspline.Bspline(knots, 3, workers=4)
+    x       = np.random.RandomState(2).uniform(0, 1, 4 * bspline.bspline.PARALLEL_MIN_SITES + 123)
+
+    assert np.array_equal( Bp(x), B(x) )
+    assert np.array_equal( Bp.derivatives(x, 2), B.derivatives(x, 2) )
+    N,  start  = B.local_basis(x, 1)
+    Np, startp = Bp.local_basis(x, 1)
+    assert np.array_equal( Np, N )  and  np.array_equal( startp, start )
+
+    for bad in (None, 0, -2):
+        try:
+            bspline.Bspline(knots, 3, workers=bad)
+        except ValueError:
+            pass
+        else:
+            assert False, "expected ValueError for workers = %r" % (bad,)
+    try:
+        splinelab.spcol(knots, 3, x[:10], workers=0)
+    except ValueError:
+        pass
+    else:
+        assert False, "spcol should have rejected workers = 0"
+
+
+def test_backends():
+    try:
+        bspline.bspline.set_backend("numba")
+    except ImportError:  # Numba not installed; only the NumPy backend is available
+        bspline.bspline.set_backend("auto")
+        assert bspline.bspline.get_backend() == "numpy"
+        return
+
+    try:
+        kv = [0,0,1,1,1,2,3,3,4,5]  # repeated interior knots, unclamped
+        x  = np.linspace(-0.5, 5.5, 301)
+        for p in range(5):
+            B = bspline.Bspline(kv, p)
+            bspline.bspline.set_backend("numba")
+            D1, s1 = B.local_derivatives(x, 5)
+            bspline.bspline.set_backend("numpy")
+            D2, s2 = B.local_derivatives(x, 5)
+            assert np.array_equal( s1, s2 )
+            assert np.allclose( D1, D2 )
+    finally:
+        bspline.bspline.set_backend("auto")
+
+
+def test_knot_insertion():
+    x = np.linspace(0, 5, 201)
+    for kv in ([0,0,0,0,1,2,2,3,4,5,5,5,5], [0,0,1,1,1,2,3,3,4,5]):  # clamped; unclamped
+        for p in range(4):
+            B = bspline.Bspline(kv, p)
+            c = np.random.RandomState(p).randn(B.n_basis, 2)
+            S = bspline.Spline(B, c)
+
+            B2, T = B.insert_knots([0.5, 2., 2., 4.25])
+            assert len(B2.knot_vector) == len(kv) + 4
+            assert csr_parts(T)[3] == (B2.n_basis, B.n_basis)
+            assert np.allclose( B2(x).dot( to_dense(T) ), B(x) )
+
+            for S2 in (S.insert_knots([3.5, 0.1, 3.5]), S.refine(3)):
+                assert np.allclose( S2(x), S(x) )
+
+
+def test_uniform_knots():
+    x = np.linspace(-1, 12, 521)
+    for backend in ("numpy", "auto"):
+        bspline.bspline.set_backend(backend)
+        try:
+            # clamped, unclamped, and with a repeated interior knot (partly uniform)
+            for kv in (splinelab.augknt(np.arange(11.), 3), np.arange(11.), [0,0,1,2,3,4,4,5,6,7,8,9,10,10]):
+                for p in range(5):
+                    B = bspline.Bspline(kv, p)
+                    if B.n_basis == 0:
+                        continue
+                    A  = B(x)
+                    dA = B.d(x)
+                    for i,xi in enumerate(x):
+                        assert np.allclose( A[i],  B(xi) )
+                        assert np.allclose( dA[i], B.d(xi) )
+        finally:
+            bspline.bspline.set_backend("auto")
+
+
+def test_spcol_repeated_sites():
+    tau = [0., 0., 0.1, 0.3, 0.3, 0.3, 0.5, 0.5, 0.75, 1.]  # Hermite-type data, up to second derivatives
+    for p in range(5):
+        B,knots = make_basis(p, nknots=7)
+        A = splinelab.spcol(knots, p, tau)
+        m = splinelab.knt2mlt(tau)
+        assert A.shape == (len(tau), B.n_basis)
+        for i in range(len(tau)):
+            assert np.allclose( A[i], B.diff(order=m[i])(tau[i]) )
+        assert np.array_equal( splinelab.spcol(knots, float(p), tau), A )  # order given as a float
+
+
+def test_pp_form():
+    x = np.linspace(0, 1, 101, endpoint=False)
+    for p in range(5):
+        B,knots = make_basis(p, nknots=6)
+        for c in (np.arange(B.n_basis) % 3 - 1., np.random.RandomState(p).randn(B.n_basis, 2)):
+            S  = bspline.Spline(B, c)
+            pp = splinelab.fn2fm(S, "pp")
+            assert pp.coefs.shape[:2] == (len(pp.breaks) - 1, p + 1)
+            assert np.allclose( splinelab.ppval(pp, x), S(x) )
+            assert np.allclose( splinelab.ppval(pp, 0.5), S(0.5) )
+
+            S2 = splinelab.fn2fm(pp, "B-")
+            assert np.allclose( S2.basis.knot_vector, knots )
+            assert np.allclose( S2.coeffs, c )
+
+    # integer coefficients
+    pp = splinelab.PPForm( np.array([0., 1., 2.]), np.array([[1, 2], [3, 4]]) )
+    assert np.allclose( splinelab.ppval(pp, [0.5, 1.5]), [2.5, 5.5] )
+
+    # no nonzero-length interval
+    for breaks in ( np.array([0.]), np.array([1., 1.]) ):
+        try:
+            splinelab.ppval( splinelab.PPForm( breaks, np.zeros( (max(len(breaks)-1, 0), 2) ) ), 0.5 )
+        except ValueError:
+            pass
+        else:
+            assert False, "ppval should have rejected breaks %s" % (breaks)
+
+    # a pp-form built from Python lists
+    pp = splinelab.PPForm( [0, 1], [[1, 2]] )
+    assert np.isclose( splinelab.ppval(pp, 0.5), 2.5 )
+    assert np.allclose( splinelab.pp2sp(pp)(np.array([0., 0.5])), [2., 2.5] )
+    for coefs in ( [[1, 2], [3, 4]], [1, 2] ):
+        try:
+            splinelab.ppval( splinelab.PPForm( [0, 1], coefs ), 0.5 )
+        except ValueError:
+            pass
+        else:
+            assert False, "ppval should have rejected coefs %s" % (coefs,)
+
+
+def test_profiling():
+    import bspline.profiling as profiling
+
+    B,knots = make_basis()
+    collmat = bspline.Bspline.__dict__["collmat"]
+    with profiling.profile() as stats:
+        B(0.25)
+        B(0.25)
+        B.collmat(np.linspace(0, 1, 10))
+        splinelab.spcol(knots, 3, [0., 0., 0.5])
+        bspline.Spline(B, np.ones(B.n_basis)).integrate(0., 0.5)
+    metrics = stats.as_dict()
+
+    assert metrics["timers"]["Bspline.collmat"]["calls"] == 1
+    assert metrics["timers"]["splinelab.spcol"]["calls"] == 1
+    assert metrics["timers"]["Bspline.__basis"]["calls"] == 4  # one scalar evaluation, recursion p = 3, ..., 0
+    assert metrics["timers"]["Spline.integrate"]["calls"] == 1
+    assert metrics["timers"]["Bspline.local_integrals"]["calls"] == 1
+    assert metrics["counters"] == { "memoize.hits" : 1, "memoize.misses" : 1 }
+
+    # disabled again: originals restored, nothing recorded
+    assert not profiling.is_enabled()
+    assert bspline.Bspline.__dict__["collmat"] is collmat
+    B.collmat([0.5])
+    assert profiling.snapshot() == metrics
+
+
+def test_integration():
+    for p in range(5):
+        B,knots = make_basis(p)
+        c = np.random.RandomState(p).randn(B.n_basis)
+        S = bspline.Spline(B, c)
+
+        # integrals of the basis functions over the whole range: (t[i+p+1] - t[i]) / (p+1)
+        A = B.integral_collmat([-1., 0., 0.5, 1., 2.])
+        assert np.allclose( A[0], 0. )  and  np.allclose( A[1], 0. )
+        assert np.allclose( A[-1], (knots[p+1:] - knots[:-p-1]) / (p+1) )
+        assert np.allclose( A[-2], A[-1] )
+
+        # against the trapezoid rule on a fine grid; endpoints outside the range are clamped
+        a = np.array([0., 0.1, 0.3, -0.5])
+        b = np.array([0.99, 0.6, 0.35, 0.5])
+        for ai,bi,I in zip(a, b, S.integrate(a, b)):
+            x = np.linspace( max(ai, 0.), bi, 20001 )
+            y = S(x)
+            assert abs( I - np.sum( (y[1:] + y[:-1]) * np.diff(x) ) / 2. ) < 1e-3  # (jumps for p = 0)
+
+        # the antiderivative agrees, and differentiates back to the spline
+        F = S.antiderivative()
+        x = np.linspace(0.05, 0.95, 7)
+        assert F.basis.p == p + 1
+        assert np.allclose( F(x), S.integrate(0., x) )
+        assert np.allclose( F.d(x), S(x) )
+
+    # knot vectors without repeated endpoints: exact up to the right end (against a fine midpoint rule)
+    for kv,p in ( (np.arange(8.), 2), (np.arange(6.), 3) ):
+        B = bspline.Bspline(kv, p)
+        S = bspline.Spline(B, np.random.RandomState(p).randn(B.n_basis))
+        F = S.antiderivative()
+        x = np.linspace(kv[0], kv[-1], 50, endpoint=False)
+        assert np.allclose( F.d(x), S(x) )
+        h  = 1e-4
+        xm = np.arange(kv[0] + h/2., kv[-1], h)
+        assert abs( S.integrate(kv[0], kv[-1]) - h * np.sum(S(xm)) ) < 1e-6
+        assert np.allclose( F(x), S.integrate(kv[0], x) )
+        assert np.allclose( B.integral_collmat(x).dot(S.coeffs), S.integrate(kv[0], x) )
+
+
+def test_gram_and_smoothing():
+    for p in range(1, 5):
+        B,knots = make_basis(p, nknots=6)
+        G  = B.gram(banded=False)
+        ab = B.gram()
+        assert ab.shape == (p+1, B.n_basis)
+        assert np.allclose( G, G.T )
+        assert np.allclose( np.diag(G), ab[p] )
+        assert np.isclose( G.sum(), 1. )  # partition of unity on [0,1]
+
+        # the penalty annihilates polynomials of degree < penalty order (here: linear functions,
+        # whose coefficients are the Greville abscissae)
+        if p >= 2:
+            R = B.gram(deriv_order=2, banded=False)
+            assert np.allclose( R.dot( splinelab.aveknt(knots[1:-1], p) ), 0. )
+
+        # heavy smoothing tends to the least-squares line
+        x  = np.linspace(0, 0.99, 50)
+        y  = np.sin(6*x)
+        ne = bspline.bspline.NormalEquations(B)
+        ne.add(x, y)
+        line = np.polyval( np.polyfit(x, y, 1), x )
+        if p >= 2:
+            assert np.allclose( ne.solve(lam=1e8)(x), line, atol=1e-4 )
+        assert np.allclose( ne.solve(lam=0.)(x), ne.solve()(x) )
+
+    # knots wider than float64 (np.longdouble): the normal equations accumulate in that dtype
+    knots = splinelab.augknt( np.linspace(0, 1, 6).astype(np.longdouble), 3 )
+    B     = bspline.Bspline(knots, 3)
+    B64   = bspline.Bspline(knots.astype(np.float64), 3)
+    x     = np.linspace(0, 0.99, 50)
+    assert B.gram().dtype == np.longdouble
+    assert np.allclose( B.gram(deriv_order=2).astype(np.float64), B64.gram(deriv_order=2) )
+    ne = bspline.bspline.NormalEquations(B)
+    ne.add(x, np.sin(6*x))
+    assert np.allclose( ne.solve().coeffs, splinelab.spap2(knots.astype(np.float64), 3, x, np.sin(6*x)).coeffs )
+
+
+def test_many_signals_and_all_orders():
+    B,knots = make_basis(3, nknots=8)
+    x = np.linspace(0, 1, 41)
+
+    C = np.random.RandomState(0).randn(B.n_basis, 20)  # more signals than p+1
+    S = bspline.Spline(B, C)
+    for k in range(3):
+        assert np.allclose( S.diff(k)(x), B.collmat(x, deriv_order=k).dot(C) )
+    assert np.allclose( S(0.3), B(0.3).dot(C) )
+
+    for backend in ("numpy", "auto"):
+        bspline.bspline.set_backend(backend)
+        try:
+            V, start = B.local_basis_all_orders(x)
+            assert V.shape == (len(x), 4, 4)
+            for q in range(4):
+                N, s = bspline.Bspline(knots, q).local_basis(x)
+                assert np.allclose( V[:, q, 3-q:], N )
+                assert np.array_equal( start + 3-q, s )
+        finally:
+            bspline.bspline.set_backend("auto")
+
+
+def test_sorted_sites():
+    kv = [0,0,0,0,0.1,0.3,0.3,0.5,0.7,0.8,0.9,1,1,1,1]  # nonuniform, repeated interior knot
+    B  = bspline.Bspline(kv, 3)
+    x  = np.sort( np.concatenate( (np.random.RandomState(0).uniform(-0.2, 1.2, 300), kv) ) )
+    perm = np.random.RandomState(1).permutation(len(x))
+    for backend in ("numpy", "auto"):
+        bspline.bspline.set_backend(backend)
+        try:
+            D1, s1 = B.local_derivatives(x, 2)        # sorted: incremental span tracking / merge
+            D2, s2 = B.local_derivatives(x[perm], 2)  # unsorted: binary search
+            assert np.array_equal( D1[perm], D2 )
+            assert np.array_equal( s1[perm], s2 )
+
+            # fewer sorted sites than knots, near the right end, the first one outside the range
+            xs = np.array( [-0.5, 0.85, 0.9, 0.95, 1.] )
+            D1, s1 = B.local_derivatives(xs, 1)
+            D2, s2 = B.local_derivatives(xs[::-1], 1)
+            assert np.array_equal( D1, D2[::-1] )
+            assert np.array_equal( s1, s2[::-1] )
+        finally:
+            bspline.bspline.set_backend("auto")
+
+
+def test_float32():
+    kv = splinelab.augknt( np.linspace(0, 1, 11), 3 )
+    x  = np.random.RandomState(0).uniform(0, 1, 500)
+    x[0:2] = [0.05, 0.5]  # a site in a non-uniform (end) interval, and one on a knot
+    for backend in ("numpy", "auto"):
+        bspline.bspline.set_backend(backend)
+        try:
+            for knots in (kv, np.concatenate( (kv[:6], [0.23], kv[6:]) )):  # uniform, nonuniform
+                B   = bspline.Bspline(knots, 3)
+                B32 = bspline.Bspline(knots, 3, dtype=np.float32)
+                assert B32.dtype == np.float32  and  B32.knot_vector.dtype == np.float32
+
+                for k in range(3):
+                    A   = B.collmat(x, deriv_order=k)
+                    A32 = B32.collmat(x, deriv_order=k)
+                    assert A32.dtype == np.float32
+                    assert np.max( np.abs(A32 - A) ) <= 1e-5 * max( np.max(np.abs(A)), 1. )
+                    assert np.array_equal( B.collmat(x, deriv_order=k, dtype=np.float32), A32 )
+
+                assert B32(0.3).dtype == np.float32  and  B32.d(0.3).dtype == np.float32
+                assert csr_parts( B32.collmat(x, sparse=True) )[0].dtype == np.float32
+                assert splinelab.spcol(knots, 3, np.sort(x), dtype=np.float32).dtype == np.float32
+        finally:
+            bspline.bspline.set_backend("auto")
+
+    # other floating-point dtypes use the NumPy path; fitting in np.longdouble keeps that precision
+    x = np.sort(x)
+    y = np.sin(6*x)
+    B = bspline.Bspline(kv, 3)
+    for dt in (np.float16, np.longdouble):
+        Bd  = bspline.Bspline(kv, 3, dtype=dt)
+        tol = 10 * np.finfo(dt).eps if np.finfo(dt).eps > 1e-10 else 1e-12
+        for k in range(3):
+            A = Bd.collmat(x, deriv_order=k)
+            assert A.dtype == dt
+            assert np.max( np.abs(A.astype(np.float64) - B.collmat(x, deriv_order=k)) ) <= tol * 1e3
+        assert csr_parts( Bd.collmat(x, sparse=True) )[0].dtype == dt
+        assert Bd.derivatives(x, 2).dtype == dt  and  Bd.gram().dtype == dt
+
+    kvl = kv.astype(np.longdouble)
+    ne  = bspline.bspline.NormalEquations( bspline.Bspline(kvl, 3) )
+    ne.add(x, y)
+    f   = ne.solve()
+    assert f.coeffs.dtype == np.longdouble
+    assert np.allclose( f.coeffs, splinelab.spap2(kv, 3, x, y).coeffs )
+    assert splinelab.spap2(kvl, 3, x, y).coeffs.dtype == np.longdouble
+    tau = np.linspace(0, 1, 12)
+    g   = splinelab.spapi( splinelab.aptknt(tau, 3).astype(np.longdouble), 3, tau, np.sin(3*tau) )
+    assert g.coeffs.dtype == np.longdouble
+    assert np.allclose( g(tau[:-1]), np.sin(3*tau[:-1]) )
+
+    try:
+        bspline.Bspline(kv, 3, dtype=int)
+    except ValueError:
+        pass
+    else:
+        assert False, "expected ValueError for an integer dtype"